@@ -0,0 +1,150 @@
+from collections import deque
+from contextlib import asynccontextmanager
+from fastapi import HTTPException
+from typing import AsyncContextManager, AsyncIterator, Optional
+import asyncio
+import os
+
+from heif_header import HeifImageInfo, read_heif_info
+
+# Decode memory assumed for files whose header has no readable ispe property
+# (about a 12 MP phone photo; libheif will most likely reject such files anyway)
+UNKNOWN_IMAGE_BYTES = 4032 * 3024 * 7
+
+
+class DecodeAdmission:
+    """
+    Admits conversions against a global budget of estimated decode memory.
+
+    The estimate comes from the HEIF header (see heif_header.read_heif_info), before
+    any pixels are decoded. Conversions that don't fit wait in FIFO order for up to
+    max_wait_seconds and are then rejected with 503 + Retry-After. Images above
+    max_pixels are rejected with 413 as decompression bombs.
+    """
+
+    def __init__(
+        self,
+        max_memory_bytes: int = 1024 * 1024 * 1024,
+        max_pixels: int = 178956970,
+        max_wait_seconds: float = 10,
+        retry_after_seconds: int = 5
+    ):
+        self.max_memory_bytes = max_memory_bytes
+        self.max_pixels = max_pixels
+        self.max_wait_seconds = max_wait_seconds
+        self.retry_after_seconds = retry_after_seconds
+
+        self.reserved_bytes = 0
+        # (bytes, future) of conversions waiting for memory, oldest first
+        self._waiters: deque = deque()
+
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_busy = 0
+        self.rejected_pixels = 0
+
+    @classmethod
+    def from_env(cls) -> "DecodeAdmission":
+        """
+        Build admission control from CONVERSION_MEMORY_BUDGET_BYTES (0 disables the budget),
+        MAX_IMAGE_PIXELS (0 disables the limit), ADMISSION_MAX_WAIT and ADMISSION_RETRY_AFTER.
+        """
+        defaults = cls()
+        return cls(
+            max_memory_bytes=int(os.environ.get('CONVERSION_MEMORY_BUDGET_BYTES', defaults.max_memory_bytes)),
+            max_pixels=int(os.environ.get('MAX_IMAGE_PIXELS', defaults.max_pixels)),
+            max_wait_seconds=float(os.environ.get('ADMISSION_MAX_WAIT', defaults.max_wait_seconds)),
+            retry_after_seconds=int(os.environ.get('ADMISSION_RETRY_AFTER', defaults.retry_after_seconds))
+        )
+
+    def check_pixels(self, info: Optional[HeifImageInfo]):
+        if self.max_pixels and info is not None and info.pixels > self.max_pixels:
+            self.rejected_pixels += 1
+            raise HTTPException(
+                status_code=413,
+                detail=f"Image is {info.width}x{info.height}, more than the maximum of {self.max_pixels} pixels"
+            )
+
+    def admit(self, content: bytes) -> AsyncContextManager[Optional[HeifImageInfo]]:
+        """
+        Hold a share of the memory budget sized from content's HEIF header while
+        the body runs. Yields the header info (None if it couldn't be read).
+        """
+        return self.admit_image(read_heif_info(content))
+
+    @asynccontextmanager
+    async def admit_image(self, info: Optional[HeifImageInfo]) -> AsyncIterator[Optional[HeifImageInfo]]:
+        """
+        Like admit, for callers that know better than the header which image will be
+        decoded (e.g. only a small embedded thumbnail).
+        """
+        self.check_pixels(info)
+
+        if not self.max_memory_bytes:
+            self.admitted += 1
+            yield info
+            return
+
+        # An image bigger than the whole budget still runs, but only on its own
+        estimate = min(info.decoded_bytes if info else UNKNOWN_IMAGE_BYTES, self.max_memory_bytes)
+        await self._acquire(estimate)
+        try:
+            yield info
+        finally:
+            self._release(estimate)
+
+    async def _acquire(self, estimate: int):
+        if not self._waiters and self.reserved_bytes + estimate <= self.max_memory_bytes:
+            self.reserved_bytes += estimate
+            self.admitted += 1
+            return
+
+        self.queued += 1
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (estimate, waiter)
+        self._waiters.append(entry)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.max_wait_seconds)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as we gave up: hand the memory back
+                self._release(estimate)
+            else:
+                waiter.cancel()
+                self._waiters.remove(entry)
+                # The head of the queue may have been blocking smaller requests
+                self._grant()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.rejected_busy += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Server is busy converting other images, please retry shortly",
+                headers={"Retry-After": str(self.retry_after_seconds)}
+            )
+        self.admitted += 1
+
+    def _release(self, estimate: int):
+        self.reserved_bytes -= estimate
+        self._grant()
+
+    def _grant(self):
+        while self._waiters:
+            estimate, waiter = self._waiters[0]
+            if self.reserved_bytes + estimate > self.max_memory_bytes:
+                break
+            self._waiters.popleft()
+            self.reserved_bytes += estimate
+            waiter.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "max_memory_bytes": self.max_memory_bytes,
+            "reserved_bytes": self.reserved_bytes,
+            "waiting": len(self._waiters),
+            "max_pixels": self.max_pixels,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected_busy": self.rejected_busy,
+            "rejected_pixels": self.rejected_pixels,
+        }
@@ -0,0 +1,265 @@
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional
+import asyncio
+import hashlib
+import logging
+import shutil
+import time
+import os
+
+from pydantic import BaseModel
+
+from worker_dirs import purge_stale_worker_dirs, worker_dir
+
+logger = logging.getLogger(__name__)
+
+
+def content_digest(content: bytes) -> str:
+    """
+    SHA-256 of the uploaded bytes. Only the digest is kept, never the input itself.
+    """
+    return hashlib.sha256(content).hexdigest()
+
+
+class ConversionCache:
+    """
+    Content-addressed cache of conversion outputs.
+
+    Entries are keyed by input digest + output format + encoder options and live in a
+    size-bounded in-memory LRU. Entries evicted from memory are demoted to an optional
+    size-bounded on-disk LRU. Every entry expires ttl_seconds after it was stored, in
+    both tiers, so converted files are never kept longer than the configured TTL.
+    Disk reads, writes and deletes run in a thread so they don't block the event loop.
+    """
+
+    def __init__(
+        self,
+        max_memory_bytes: int = 64 * 1024 * 1024,
+        ttl_seconds: float = 60,
+        disk_dir: Optional[str] = None,
+        max_disk_bytes: int = 1024 * 1024 * 1024
+    ):
+        self.max_memory_bytes = max_memory_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_bytes = max_disk_bytes if disk_dir else 0
+        self.base_disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_dir = worker_dir(self.base_disk_dir) if disk_dir else None
+
+        # key -> (expires_at, data) / (expires_at, size), least recently used first
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._disk: "OrderedDict[str, tuple]" = OrderedDict()
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        if self.disk_dir:
+            # Entries left by a previous process with this pid have no known expiry; start clean
+            shutil.rmtree(self.disk_dir, ignore_errors=True)
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            # Directories of crashed workers are never purged by their owner
+            purge_stale_worker_dirs(self.base_disk_dir, self.ttl_seconds)
+
+    @classmethod
+    def from_env(cls) -> "ConversionCache":
+        """
+        Build the cache from CONVERSION_CACHE_MEMORY_BYTES (0 disables the cache),
+        CONVERSION_CACHE_TTL, CONVERSION_CACHE_DIR and CONVERSION_CACHE_DISK_BYTES.
+        """
+        return cls(
+            max_memory_bytes=int(os.environ.get('CONVERSION_CACHE_MEMORY_BYTES', 64 * 1024 * 1024)),
+            ttl_seconds=float(os.environ.get('CONVERSION_CACHE_TTL', 60)),
+            disk_dir=os.environ.get('CONVERSION_CACHE_DIR') or None,
+            max_disk_bytes=int(os.environ.get('CONVERSION_CACHE_DISK_BYTES', 1024 * 1024 * 1024))
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and (self.max_memory_bytes > 0 or self.max_disk_bytes > 0)
+
+    @staticmethod
+    def make_key(digest: str, output_format: str, options: BaseModel) -> str:
+        """
+        Cache key for one output of one input, covering every option that affects the bytes.
+        """
+        variant = f"{digest}|{output_format}|{options.model_dump_json()}"
+        return hashlib.sha256(variant.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        now = time.monotonic()
+
+        entry = self._memory.get(key)
+        if entry is not None:
+            expires_at, data = entry
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return data
+            self._drop_memory(key)
+            self.expirations += 1
+
+        entry = self._disk.get(key)
+        if entry is not None:
+            expires_at, _ = entry
+            data = await asyncio.to_thread(self._read_disk, key) if expires_at > now else None
+            if data is not None:
+                # Promote back to memory, keeping the original expiry
+                await self._remove_files([self._drop_disk(key)])
+                await self._demote(self._store_memory(key, expires_at, data))
+                self.hits += 1
+                return data
+            await self._remove_files([self._drop_disk(key)])
+            self.expirations += 1
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, data: bytes):
+        if not self.enabled:
+            return
+
+        expires_at = time.monotonic() + self.ttl_seconds
+        self._drop_memory(key)
+        await self._remove_files([self._drop_disk(key)])
+
+        if len(data) <= self.max_memory_bytes:
+            await self._demote(self._store_memory(key, expires_at, data))
+        elif len(data) <= self.max_disk_bytes:
+            await self._store_disk(key, expires_at, data)
+
+    async def purge_expired(self):
+        """
+        Remove every expired entry from both tiers, and directories left by dead workers.
+        """
+        now = time.monotonic()
+        for key in [k for k, (expires_at, _) in self._memory.items() if expires_at <= now]:
+            self._drop_memory(key)
+            self.expirations += 1
+        expired = [k for k, (expires_at, _) in self._disk.items() if expires_at <= now]
+        self.expirations += len(expired)
+        await self._remove_files([self._drop_disk(key) for key in expired])
+        if self.base_disk_dir:
+            await asyncio.to_thread(purge_stale_worker_dirs, self.base_disk_dir, self.ttl_seconds)
+
+    def clear(self):
+        """
+        Drop every entry from the index; disk files are left to close() or the caller.
+        """
+        for key in list(self._memory):
+            self._drop_memory(key)
+        for key in list(self._disk):
+            self._drop_disk(key)
+
+    def close(self):
+        """
+        Drop all entries and remove this process's disk directory.
+        """
+        self.clear()
+        if self.disk_dir:
+            shutil.rmtree(self.disk_dir, ignore_errors=True)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self.memory_bytes,
+            "max_memory_bytes": self.max_memory_bytes,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self.disk_bytes,
+            "max_disk_bytes": self.max_disk_bytes,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+    def _store_memory(self, key: str, expires_at: float, data: bytes) -> List[tuple]:
+        """
+        Add an entry to memory and evict least recently used entries over the budget.
+        Returns the evicted (key, expires_at, data) entries for _demote.
+        """
+        self._memory[key] = (expires_at, data)
+        self.memory_bytes += len(data)
+
+        evicted = []
+        while self.memory_bytes > self.max_memory_bytes and self._memory:
+            old_key, (old_expires_at, old_data) = self._memory.popitem(last=False)
+            self.memory_bytes -= len(old_data)
+            evicted.append((old_key, old_expires_at, old_data))
+        return evicted
+
+    async def _demote(self, evicted: List[tuple]):
+        """
+        Move entries evicted from memory to disk when possible.
+        """
+        for key, expires_at, data in evicted:
+            if self.disk_dir and len(data) <= self.max_disk_bytes:
+                await self._store_disk(key, expires_at, data)
+            else:
+                self.evictions += 1
+
+    async def _store_disk(self, key: str, expires_at: float, data: bytes):
+        try:
+            await asyncio.to_thread(self._write_disk, key, data)
+        except OSError as e:
+            logger.warning(f"Could not write conversion cache entry to disk: {str(e)}")
+            self.evictions += 1
+            return
+
+        # Another request may have stored the same key while the file was being written;
+        # the bytes are identical (the key covers input and options), so keep one entry
+        entry = self._disk.pop(key, None)
+        if entry is not None:
+            self.disk_bytes -= entry[1]
+        self._disk[key] = (expires_at, len(data))
+        self.disk_bytes += len(data)
+
+        stale_paths = []
+        while self.disk_bytes > self.max_disk_bytes and self._disk:
+            stale_paths.append(self._drop_disk(next(iter(self._disk))))
+            self.evictions += 1
+        await self._remove_files(stale_paths)
+
+    def _write_disk(self, key: str, data: bytes):
+        # The directory may have been removed from outside (e.g. a tmp cleaner); recreate it
+        self.disk_dir.mkdir(parents=True, exist_ok=True)
+        (self.disk_dir / key).write_bytes(data)
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        try:
+            return (self.disk_dir / key).read_bytes()
+        except OSError:
+            return None
+
+    def _drop_memory(self, key: str):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self.memory_bytes -= len(entry[1])
+
+    def _drop_disk(self, key: str) -> Optional[Path]:
+        """
+        Remove an entry from the disk index and return its file for _remove_files.
+        """
+        entry = self._disk.pop(key, None)
+        if entry is None:
+            return None
+        self.disk_bytes -= entry[1]
+        return self.disk_dir / key
+
+    async def _remove_files(self, paths: List[Optional[Path]]):
+        paths = [path for path in paths if path is not None]
+        if paths:
+            await asyncio.to_thread(self._unlink, paths)
+
+    @staticmethod
+    def _unlink(paths: List[Path]):
+        for path in paths:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,293 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+from contextvars import ContextVar
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Optional, TypeVar
+import multiprocessing
+import functools
+import itertools
+import asyncio
+import heapq
+import logging
+import math
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# Supported executor backends:
+#   thread  - ThreadPoolExecutor (Pillow/libheif release the GIL while decoding/encoding)
+#   process - ProcessPoolExecutor (full isolation, one interpreter per worker)
+#   inline  - run on the calling thread (tests and debugging only, blocks the event loop)
+EXECUTOR_BACKENDS = ["thread", "process", "inline"]
+
+# Weight of the latest conversion in the moving average of conversion time
+SERVICE_TIME_SMOOTHING = 0.2
+
+# Priority classes, most urgent first:
+#   interactive - single-file conversions and previews a user is waiting on
+#   batch       - files of /convert-batch requests
+#   background  - asynchronous jobs nobody is actively waiting for
+PRIORITY_CLASSES = ["interactive", "batch", "background"]
+
+# Priority class of conversions submitted from the current request (or task)
+conversion_priority: ContextVar[str] = ContextVar("conversion_priority", default="interactive")
+
+# Called when a conversion submitted from the current task has its slot and starts on the
+# pool, after any queueing (progress reporting); None when nobody is interested
+conversion_started: ContextVar[Optional[Callable[[], None]]] = ContextVar("conversion_started", default=None)
+
+
+class PrioritySlots:
+    """
+    Semaphore that hands free slots to the most urgent waiter instead of the oldest.
+
+    Waiters are ordered by enqueue time plus aging_seconds per priority class below
+    "interactive", so a waiter gains one class of priority for every aging_seconds it
+    has waited and lower classes are never starved.
+    """
+
+    def __init__(self, slots: int, aging_seconds: float):
+        self.aging_seconds = aging_seconds
+        self._free = slots
+        self._waiters: list = []
+        self._order = itertools.count()
+
+    async def acquire(self, priority: str):
+        if self._free > 0:
+            self._free -= 1
+            return
+
+        deadline = time.monotonic() + PRIORITY_CLASSES.index(priority) * self.aging_seconds
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (deadline, next(self._order), waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted a slot just as we were cancelled: pass it on
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            # Cancelled waiters are left in the heap and skipped here
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._free += 1
+
+
+def default_worker_count() -> int:
+    """
+    Number of CPUs available to this process (respects container CPU affinity).
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return max(1, len(os.sched_getaffinity(0)))
+    return max(1, os.cpu_count() or 1)
+
+
+class ConversionExecutor:
+    """
+    Runs CPU-bound conversion functions off the event loop.
+    Functions submitted to the process backend must be importable module-level callables
+    (see converter.py) and their arguments must be picklable.
+
+    At most max_concurrency conversions run at once; the rest wait in a queue. Callers
+    should check queue_full() before accepting new work so the queue stays within
+    max_queue_depth (0 means unbounded) and excess traffic is shed instead of piling up.
+    Queued conversions are started by priority class (see conversion_priority), with
+    aging so batch and background work still make progress under interactive load.
+    """
+
+    def __init__(
+        self,
+        backend: str = "thread",
+        max_workers: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        max_queue_depth: Optional[int] = None,
+        priority_aging_seconds: float = 5
+    ):
+        if backend not in EXECUTOR_BACKENDS:
+            raise ValueError(
+                f"Invalid executor backend '{backend}'. Supported backends: {', '.join(EXECUTOR_BACKENDS)}"
+            )
+
+        self.backend = backend
+        self.max_workers = max_workers or default_worker_count()
+        # Global cap on conversions submitted to the pool, shared by every request
+        self.max_concurrency = max_concurrency or self.max_workers
+        self._slots = PrioritySlots(self.max_concurrency, priority_aging_seconds)
+        self._pool: Optional[Executor] = None
+
+        self.max_queue_depth = self.max_concurrency * 4 if max_queue_depth is None else max_queue_depth
+        self.waiting = 0
+        self.waiting_by_priority = {priority: 0 for priority in PRIORITY_CLASSES}
+        self.started_by_priority = {priority: 0 for priority in PRIORITY_CLASSES}
+        self.wait_seconds_by_priority = {priority: 0.0 for priority in PRIORITY_CLASSES}
+        self.running = 0
+        self.completed = 0
+        self.shed = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        # Moving average of how long a conversion holds its slot, for Retry-After estimates
+        self.service_time_seconds = 0.0
+
+        if backend == "thread":
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="heic-convert"
+            )
+        elif backend == "process":
+            # Use spawn so workers don't inherit the event loop / Mongo client threads
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+
+        logger.info(
+            f"Conversion executor started: backend={self.backend}, workers={self.max_workers}, "
+            f"max_concurrency={self.max_concurrency}, max_queue_depth={self.max_queue_depth}"
+        )
+
+    @classmethod
+    def from_env(cls) -> "ConversionExecutor":
+        """
+        Build the executor from CONVERSION_EXECUTOR, CONVERSION_WORKERS,
+        CONVERSION_MAX_CONCURRENCY, CONVERSION_QUEUE_DEPTH and CONVERSION_PRIORITY_AGING
+        environment variables.
+        """
+        backend = os.environ.get('CONVERSION_EXECUTOR', 'thread').lower()
+        workers = os.environ.get('CONVERSION_WORKERS')
+        max_concurrency = os.environ.get('CONVERSION_MAX_CONCURRENCY')
+        max_queue_depth = os.environ.get('CONVERSION_QUEUE_DEPTH')
+        return cls(
+            backend=backend,
+            max_workers=int(workers) if workers else None,
+            max_concurrency=int(max_concurrency) if max_concurrency else None,
+            max_queue_depth=int(max_queue_depth) if max_queue_depth else None,
+            priority_aging_seconds=float(os.environ.get('CONVERSION_PRIORITY_AGING', 5))
+        )
+
+    def queue_full(self) -> bool:
+        """
+        True if new work should be shed: the queue of conversions waiting for a slot is full.
+        Counts the caller as shed, so only call this when about to reject.
+        """
+        if self.max_queue_depth and self.waiting >= self.max_queue_depth:
+            self.shed += 1
+            return True
+        return False
+
+    def retry_after(self) -> int:
+        """
+        Seconds until the current queue is expected to drain, from the average conversion time.
+        """
+        drain_seconds = (self.waiting + self.running) * self.service_time_seconds / self.max_concurrency
+        return max(1, math.ceil(drain_seconds))
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) on the worker pool and await its result.
+        Waits for a global concurrency slot first, at the caller's conversion_priority,
+        then calls the caller's conversion_started hook.
+        """
+        priority = conversion_priority.get()
+        queued_at = time.monotonic()
+        self.waiting += 1
+        self.waiting_by_priority[priority] += 1
+        try:
+            await self._slots.acquire(priority)
+        finally:
+            self.waiting -= 1
+            self.waiting_by_priority[priority] -= 1
+
+        started_at = time.monotonic()
+        self._record_wait(priority, started_at - queued_at)
+        self.running += 1
+        try:
+            on_started = conversion_started.get()
+            if on_started is not None:
+                on_started()
+            if self._pool is None:
+                return fn(*args, **kwargs)
+
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool, functools.partial(fn, *args, **kwargs))
+        finally:
+            self.running -= 1
+            self._slots.release()
+            self._record_service(time.monotonic() - started_at)
+
+    def _record_wait(self, priority: str, wait_seconds: float):
+        self.started_by_priority[priority] += 1
+        self.wait_seconds_by_priority[priority] += wait_seconds
+        self.total_wait_seconds += wait_seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+    def _record_service(self, service_seconds: float):
+        self.completed += 1
+        if self.completed == 1:
+            self.service_time_seconds = service_seconds
+        else:
+            self.service_time_seconds += SERVICE_TIME_SMOOTHING * (service_seconds - self.service_time_seconds)
+
+    def stats(self) -> dict:
+        started = self.completed + self.running
+        return {
+            "backend": self.backend,
+            "max_concurrency": self.max_concurrency,
+            "running": self.running,
+            "queue_depth": self.waiting,
+            "max_queue_depth": self.max_queue_depth,
+            "completed": self.completed,
+            "shed": self.shed,
+            "avg_wait_seconds": self.total_wait_seconds / started if started else 0.0,
+            "max_wait_seconds": self.max_wait_seconds,
+            "avg_conversion_seconds": self.service_time_seconds,
+            "retry_after_seconds": self.retry_after(),
+            "priority_aging_seconds": self._slots.aging_seconds,
+            "priorities": {
+                priority: {
+                    "queue_depth": self.waiting_by_priority[priority],
+                    "started": self.started_by_priority[priority],
+                    "avg_wait_seconds": (
+                        self.wait_seconds_by_priority[priority] / self.started_by_priority[priority]
+                        if self.started_by_priority[priority] else 0.0
+                    ),
+                }
+                for priority in PRIORITY_CLASSES
+            },
+        }
+
+    def shutdown(self, wait: bool = True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+
+
+async def map_ordered(
+    func: Callable[[T], Awaitable[R]],
+    items: Iterable[T],
+    concurrency: int
+) -> AsyncIterator[R]:
+    """
+    Run func over items with at most `concurrency` calls in flight and yield
+    the results in input order. Items are pulled from the iterable lazily.
+    func should handle its own errors; an exception propagates to the consumer.
+    """
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(asyncio.ensure_future(func(item)))
+            if len(pending) >= concurrency:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        # Consumer stopped early (e.g. client disconnected): drop outstanding work
+        for task in pending:
+            task.cancel()
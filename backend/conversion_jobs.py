@@ -0,0 +1,238 @@
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+import asyncio
+import logging
+import shutil
+import tempfile
+import time
+import uuid
+import os
+
+from worker_dirs import purge_stale_worker_dirs, worker_dir
+
+logger = logging.getLogger(__name__)
+
+# Job lifecycle: queued -> running -> completed | failed
+JOB_STATUSES = ["queued", "running", "completed", "failed"]
+
+# Per-file lifecycle: queued -> converting -> done | failed
+FILE_STATUSES = ["queued", "converting", "done", "failed"]
+
+# Progress events published for each file, in order: queued, decoding, then done or failed.
+# Decoding and encoding run as one call on the worker pool, so "decoding" marks the
+# start of that call, once the file is through admission control and the pool queue,
+# and there is no separate encoding event. A file that fails before it gets that far
+# goes straight from queued to failed.
+FILE_EVENTS = ["queued", "decoding", "done", "failed"]
+
+
+def utc_now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class JobFile:
+    """
+    One input file of a conversion job and its progress.
+    """
+
+    def __init__(self, index: int, filename: str, input_path: Path, size: int):
+        self.index = index
+        self.filename = filename
+        self.input_path = input_path
+        self.size = size
+        self.status = "queued"
+        self.error: Optional[str] = None
+        # Output entry names and their sizes in bytes, in ZIP order
+        self.outputs: Dict[str, int] = {}
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        # Seconds from job submission until the conversion started on the worker pool,
+        # and from then until the file was done, once known
+        self.queued_seconds: Optional[float] = None
+        self.convert_seconds: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "index": self.index,
+            "filename": self.filename,
+            "size": self.size,
+            "status": self.status,
+            "error": self.error,
+            "outputs": self.outputs,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queued_seconds": self.queued_seconds,
+            "convert_seconds": self.convert_seconds,
+        }
+
+
+class ConversionJob:
+    """
+    An asynchronous batch conversion: inputs spooled to the job directory and converted
+    in the background. Each file's outputs are stored separately so they can be
+    downloaded as soon as that file is done, or together as one archive at the end.
+    """
+
+    def __init__(self, job_id: str, directory: Path, settings: dict):
+        self.id = job_id
+        self.directory = directory
+        # Request parameters (output formats, options, ...) as passed to the job runner
+        self.settings = settings
+        self.files: List[JobFile] = []
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.created_at = utc_now()
+        self.created_monotonic = time.monotonic()
+        self.completed_at: Optional[str] = None
+        # time.time() after which the job and its result are deleted (set on completion)
+        self.expires_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        # Progress events as (id, event type, data), ids counting up from 1
+        self.events: List[tuple] = []
+        self._event_added = asyncio.Event()
+
+    def output_path(self, job_file: JobFile, name: str) -> Path:
+        return self.directory / "outputs" / str(job_file.index) / name
+
+    def emit(self, event: str, data: dict):
+        """
+        Record a progress event and wake up everyone waiting in wait_for_events.
+        """
+        self.events.append((len(self.events) + 1, event, data))
+        self._event_added.set()
+        self._event_added = asyncio.Event()
+
+    async def wait_for_events(self, after: int, timeout: float) -> List[tuple]:
+        """
+        Events with an id greater than after, waiting up to timeout seconds for one to
+        arrive if there are none yet. Returns an empty list on timeout.
+        """
+        if len(self.events) <= after and not self.finished:
+            try:
+                await asyncio.wait_for(self._event_added.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.events[after:]
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def to_dict(self) -> dict:
+        counts = {status: 0 for status in FILE_STATUSES}
+        for job_file in self.files:
+            counts[job_file.status] += 1
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "completed_at": self.completed_at,
+            "expires_at": (
+                datetime.fromtimestamp(self.expires_at, timezone.utc).isoformat() if self.expires_at else None
+            ),
+            "total_files": len(self.files),
+            "completed_files": counts["done"],
+            "failed_files": counts["failed"],
+            "pending_files": counts["queued"] + counts["converting"],
+            "files": [job_file.to_dict() for job_file in self.files],
+        }
+
+
+class JobStore:
+    """
+    Jobs and their files on local disk, one directory per job under root_dir.
+
+    Inputs are deleted as soon as they are converted. Results are kept for ttl_seconds
+    after the job finishes and then purged together with the job record. At most
+    max_active_jobs may be queued or running at once.
+    """
+
+    def __init__(self, root_dir: Optional[str] = None, ttl_seconds: float = 3600, max_active_jobs: int = 100):
+        self.ttl_seconds = ttl_seconds
+        self.max_active_jobs = max_active_jobs
+        self.base_dir = Path(root_dir) if root_dir else Path(tempfile.gettempdir()) / "heic-jobs"
+        self.root_dir = worker_dir(self.base_dir)
+        self._jobs: Dict[str, ConversionJob] = {}
+
+        # Jobs are only tracked in memory, so anything left by a previous process is orphaned,
+        # including the directories of workers that crashed or were killed
+        shutil.rmtree(self.root_dir, ignore_errors=True)
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        self.purge_stale_workers()
+
+    @classmethod
+    def from_env(cls) -> "JobStore":
+        """
+        Build the store from JOBS_DIR, JOB_RESULT_TTL and MAX_ACTIVE_JOBS environment variables.
+        """
+        return cls(
+            root_dir=os.environ.get('JOBS_DIR') or None,
+            ttl_seconds=float(os.environ.get('JOB_RESULT_TTL', 3600)),
+            max_active_jobs=int(os.environ.get('MAX_ACTIVE_JOBS', 100))
+        )
+
+    def active_jobs(self) -> int:
+        return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def create(self, settings: dict) -> ConversionJob:
+        job_id = uuid.uuid4().hex
+        directory = self.root_dir / job_id
+        # parents: the root may have been removed from outside (e.g. a tmp cleaner)
+        directory.mkdir(parents=True)
+        job = ConversionJob(job_id, directory, settings)
+        self._jobs[job_id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[ConversionJob]:
+        job = self._jobs.get(job_id)
+        if job is not None and job.expires_at is not None and job.expires_at <= time.time():
+            self.delete(job_id)
+            return None
+        return job
+
+    def finish(self, job: ConversionJob, status: str, error: Optional[str] = None):
+        job.status = status
+        job.error = error
+        job.completed_at = utc_now()
+        job.expires_at = time.time() + self.ttl_seconds
+        job.emit("job", {"job_id": job.id, "status": status, "error": error})
+
+    def delete(self, job_id: str):
+        job = self._jobs.pop(job_id, None)
+        if job is None:
+            return
+        if job.task is not None and not job.task.done():
+            job.task.cancel()
+        shutil.rmtree(job.directory, ignore_errors=True)
+
+    def purge_expired(self):
+        now = time.time()
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.expires_at and job.expires_at <= now]:
+            self.delete(job_id)
+
+    def purge_stale_workers(self):
+        """
+        Remove job directories of other workers that are gone (blocking; run in a thread).
+        """
+        purge_stale_worker_dirs(self.base_dir, self.ttl_seconds)
+
+    def close(self):
+        """
+        Cancel running jobs and remove this process's job directory.
+        """
+        for job_id in list(self._jobs):
+            self.delete(job_id)
+        shutil.rmtree(self.root_dir, ignore_errors=True)
+
+    def stats(self) -> dict:
+        statuses = {status: 0 for status in JOB_STATUSES}
+        for job in self._jobs.values():
+            statuses[job.status] += 1
+        return {
+            "jobs": len(self._jobs),
+            "max_active_jobs": self.max_active_jobs,
+            "ttl_seconds": self.ttl_seconds,
+            **statuses,
+        }
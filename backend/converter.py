@@ -0,0 +1,491 @@
+from PIL import Image, features
+import pillow_heif
+from pydantic import BaseModel, ConfigDict
+import img2pdf
+import io
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+
+# Register HEIF opener with Pillow (also needed inside process-pool workers)
+pillow_heif.register_heif_opener()
+
+
+# Supported output formats; AVIF needs a Pillow build with libavif
+OUTPUT_FORMATS = ["jpeg", "jpg", "png", "pdf", "webp"] + (["avif"] if features.check("avif") else [])
+
+# Encoder speed presets for WebP (method 0-6, higher is slower/smaller)
+# and AVIF (speed 0-10, lower is slower/smaller)
+ENCODER_SPEEDS = {
+    "fast": {"webp_method": 0, "avif_speed": 10},
+    "balanced": {"webp_method": 4, "avif_speed": 6},
+    "slow": {"webp_method": 6, "avif_speed": 2},
+}
+
+# Named encoder profiles trading CPU time for output size.
+# Per-request overrides in ConversionOptions take precedence over profile values.
+# Every profile strips EXIF (which can carry GPS location) and ICC metadata, like the
+# original encoder did; keeping it takes an explicit strip_metadata=false.
+ENCODER_PROFILES = {
+    "fast": {
+        "quality": 80,
+        "optimize": False,
+        "progressive": False,
+        "subsampling": "4:2:0",
+        "compress_level": 1,
+        "strip_metadata": True,
+        "speed": "fast",
+    },
+    "balanced": {
+        "quality": 85,
+        "optimize": False,
+        "progressive": False,
+        "subsampling": "4:2:0",
+        "compress_level": 6,
+        "strip_metadata": True,
+        "speed": "balanced",
+    },
+    "smallest": {
+        "quality": 75,
+        "optimize": True,
+        "progressive": True,
+        "subsampling": "4:2:0",
+        "compress_level": 9,
+        "strip_metadata": True,
+        "speed": "slow",
+    },
+}
+DEFAULT_ENCODER_PROFILE = "balanced"
+
+# Chroma subsampling values accepted by Pillow's JPEG encoder
+JPEG_SUBSAMPLING = ["4:4:4", "4:2:2", "4:2:0"]
+
+# PDF page encodings: "jpeg" embeds a DCT stream, "lossless" embeds a Flate-compressed PNG
+PDF_MODES = ["jpeg", "lossless"]
+
+
+class ConversionOptions(BaseModel):
+    """
+    Encoder options for a conversion. Immutable so it can be hashed and sent to worker processes.
+    """
+    model_config = ConfigDict(frozen=True)
+    
+    pdf_mode: str = "jpeg"
+    
+    # Encoder profile and per-request overrides (None = use the profile value)
+    profile: str = DEFAULT_ENCODER_PROFILE
+    quality: Optional[int] = None
+    optimize: Optional[bool] = None
+    progressive: Optional[bool] = None
+    subsampling: Optional[str] = None
+    compress_level: Optional[int] = None
+    strip_metadata: Optional[bool] = None
+    speed: Optional[str] = None  # WebP/AVIF encoder speed preset (see ENCODER_SPEEDS)
+    
+    # Downscaling applied before encoding (never upscales)
+    max_width: Optional[int] = None
+    max_height: Optional[int] = None
+    scale: Optional[float] = None
+
+
+def encoder_settings(options: ConversionOptions) -> dict:
+    """
+    Resolve the effective encoder settings: profile values with explicit overrides applied.
+    """
+    settings = dict(ENCODER_PROFILES[options.profile])
+    for name in settings:
+        value = getattr(options, name)
+        if value is not None:
+            settings[name] = value
+    return settings
+
+
+# HEIC input: raw bytes, a binary file object, or a filesystem path
+HeicSource = Union[bytes, bytearray, memoryview, BinaryIO, str]
+
+
+def open_heic(source: HeicSource) -> Image.Image:
+    """
+    Open a HEIC image from bytes, a file object or a path without touching disk for in-memory input.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    return Image.open(source)
+
+
+def target_size(size: Tuple[int, int], options: ConversionOptions) -> Tuple[int, int]:
+    """
+    Output size after applying scale and max_width/max_height, preserving aspect ratio.
+    """
+    width, height = size
+    factor = options.scale or 1.0
+    if options.max_width:
+        factor = min(factor, options.max_width / width)
+    if options.max_height:
+        factor = min(factor, options.max_height / height)
+    if factor >= 1.0:
+        return size
+    return max(1, round(width * factor)), max(1, round(height * factor))
+
+
+def load_heic(source: HeicSource, options: ConversionOptions) -> Image.Image:
+    """
+    Decode a HEIC image and downscale it per options before any encoding work.
+    reducing_gap makes Pillow shrink by an integer factor first (cheap box reduce)
+    and only run the Lanczos filter on the already reduced image.
+    """
+    return downscale(open_heic(source), options)
+
+
+def downscale(img: Image.Image, options: ConversionOptions) -> Image.Image:
+    """
+    Apply the requested downscaling to a decoded image, releasing the full-size frame.
+    """
+    size = target_size(img.size, options)
+    if size == img.size:
+        return img
+    
+    resized = img.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    img.close()
+    return resized
+
+
+def flatten_to_rgb(img: Image.Image) -> Image.Image:
+    """
+    Composite transparent images onto a white background and normalize the mode to RGB/L.
+    """
+    if img.mode in ('RGBA', 'LA'):
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        return background
+    if img.mode not in ('RGB', 'L'):
+        return img.convert('RGB')
+    return img
+
+
+def encode_pdf_page(img: Image.Image, options: ConversionOptions) -> bytes:
+    """
+    Encode a page image for img2pdf.
+    JPEG pages are embedded as-is (DCTDecode); lossless pages are PNG, which img2pdf
+    re-wraps as a Flate stream without decoding the pixels again.
+    The ICC profile is only embedded when strip_metadata is off, as in encode_image.
+    """
+    page = flatten_to_rgb(img)
+    settings = encoder_settings(options)
+    icc_profile = None if settings["strip_metadata"] else img.info.get("icc_profile")
+    page_buffer = io.BytesIO()
+    if options.pdf_mode == 'lossless':
+        page.save(
+            page_buffer,
+            'PNG',
+            compress_level=settings["compress_level"],
+            icc_profile=icc_profile  # None also drops the profile Pillow would copy from img.info
+        )
+    else:
+        page.save(
+            page_buffer,
+            'JPEG',
+            quality=settings["quality"],
+            optimize=settings["optimize"],
+            subsampling=settings["subsampling"],
+            **({"icc_profile": icc_profile} if icc_profile else {})
+        )
+    return page_buffer.getvalue()
+
+
+def convert_heic_to_pdf_page(source: HeicSource, options: Optional[ConversionOptions] = None) -> bytes:
+    """
+    Decode one HEIC image and return its encoded PDF page (see encode_pdf_page).
+    The decoded pixels are released before returning, so callers building a
+    multi-page PDF only ever hold compressed pages.
+    """
+    options = options or ConversionOptions()
+    img = load_heic(source, options)
+    try:
+        return encode_pdf_page(img, options)
+    finally:
+        img.close()
+
+
+def assemble_pdf(pages: List[bytes]) -> bytes:
+    """
+    Build a single PDF with one page per encoded image (in order) without re-encoding them.
+    """
+    return img2pdf.convert(pages)
+
+
+def encode_output(img: Image.Image, output_format: str, options: ConversionOptions) -> bytes:
+    """
+    Encode an already decoded image into one output format.
+    """
+    if output_format == 'pdf':
+        # Encode the page once in memory and let img2pdf embed it without re-encoding
+        return assemble_pdf([encode_pdf_page(img, options)])
+    return encode_image(img, output_format, options)
+
+
+def convert_heic_to_formats(
+    source: HeicSource,
+    output_formats: List[str],
+    options: Optional[ConversionOptions] = None
+) -> Dict[str, bytes]:
+    """
+    Decode a HEIC image once and encode it into every requested format.
+    Decoding dominates HEIC conversion cost, so extra formats are cheap.
+    """
+    options = options or ConversionOptions()
+    
+    # Open HEIC image (downscaled if requested)
+    img = load_heic(source, options)
+    try:
+        return {output_format: encode_output(img, output_format, options) for output_format in output_formats}
+    finally:
+        img.close()
+
+
+def convert_heic_to_format(
+    source: HeicSource,
+    output_format: str,
+    options: Optional[ConversionOptions] = None
+) -> bytes:
+    """
+    Convert HEIC image to specified format and return bytes.
+    """
+    return convert_heic_to_formats(source, [output_format], options)[output_format]
+
+
+def convert_heic_images(
+    source: HeicSource,
+    output_formats: List[str],
+    options: Optional[ConversionOptions] = None,
+    include_auxiliary: bool = False
+) -> List[Tuple[str, Dict[str, bytes]]]:
+    """
+    Convert every top-level image in a HEIF container (bursts, collections) in one
+    decode session, optionally with each image's depth and auxiliary images.
+    Returns (label, outputs by format) pairs in container order, where label is the
+    1-based image index, with a "_depth<n>" or "_<aux type>" suffix for secondary images.
+    Images are decoded one at a time, so only one frame's pixels are held in memory.
+    """
+    options = options or ConversionOptions()
+    start = source.tell() if hasattr(source, "read") else 0
+    
+    def open_container() -> pillow_heif.HeifFile:
+        # pillow_heif caches an image's decoded pixels on its HeifImage (and depth images)
+        # for as long as the HeifFile lives, so each image gets a fresh container that is
+        # dropped once its outputs are encoded
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return pillow_heif.open_heif(io.BytesIO(source))
+        if hasattr(source, "read"):
+            source.seek(start)
+        return pillow_heif.open_heif(source)
+    
+    def convert_image(img: Image.Image) -> Dict[str, bytes]:
+        img = downscale(img, options)
+        try:
+            return {output_format: encode_output(img, output_format, options) for output_format in output_formats}
+        finally:
+            img.close()
+    
+    results = []
+    image_count = len(open_container())
+    for index in range(1, image_count + 1):
+        heif_image = open_container()[index - 1]
+        results.append((str(index), convert_image(heif_image.to_pillow())))
+        
+        if not include_auxiliary:
+            continue
+        
+        for depth_index, depth_image in enumerate(heif_image.info.get("depth_images") or [], start=1):
+            results.append((f"{index}_depth{depth_index}", convert_image(depth_image.to_pillow())))
+        
+        for aux_type, aux_ids in (heif_image.info.get("aux") or {}).items():
+            # e.g. "urn:com:apple:photo:2020:aux:hdrgainmap" -> "hdrgainmap"
+            aux_name = aux_type.rsplit(':', 1)[-1] or "aux"
+            for aux_index, aux_id in enumerate(aux_ids, start=1):
+                suffix = aux_name if len(aux_ids) == 1 else f"{aux_name}{aux_index}"
+                results.append((f"{index}_{suffix}", convert_image(heif_image.get_aux_image(aux_id).to_pillow())))
+    
+    return results
+
+
+def encode_image(img: Image.Image, output_format: str, options: ConversionOptions) -> bytes:
+    """
+    Encode a decoded image as JPEG, PNG, WebP or AVIF using the resolved encoder settings.
+    EXIF and ICC metadata from the source are only carried over when strip_metadata is off.
+    """
+    settings = encoder_settings(options)
+    
+    if settings["strip_metadata"]:
+        exif, icc_profile = b"", None
+    else:
+        exif, icc_profile = img.info.get("exif") or b"", img.info.get("icc_profile")
+    
+    output_buffer = io.BytesIO()
+    if output_format in ['jpeg', 'jpg']:
+        # Convert RGBA to RGB (JPEG has no alpha channel)
+        flatten_to_rgb(img).save(
+            output_buffer,
+            'JPEG',
+            quality=settings["quality"],
+            optimize=settings["optimize"],
+            progressive=settings["progressive"],
+            subsampling=settings["subsampling"],
+            exif=exif,
+            **({"icc_profile": icc_profile} if icc_profile else {})
+        )
+    elif output_format in ['webp', 'avif']:
+        if img.mode not in ('RGB', 'RGBA', 'L'):
+            img = img.convert('RGBA' if 'A' in img.mode else 'RGB')
+        speed = ENCODER_SPEEDS[settings["speed"]]
+        if output_format == 'webp':
+            speed_params = {"method": speed["webp_method"]}
+        else:
+            speed_params = {"speed": speed["avif_speed"]}
+        img.save(
+            output_buffer,
+            output_format.upper(),
+            quality=settings["quality"],
+            exif=exif,
+            icc_profile=icc_profile,
+            **speed_params
+        )
+    else:
+        img.save(
+            output_buffer,
+            output_format.upper(),
+            compress_level=settings["compress_level"],
+            optimize=settings["optimize"],
+            exif=exif,
+            icc_profile=icc_profile  # None also drops the profile Pillow would copy from img.info
+        )
+    return output_buffer.getvalue()
+
+
+# Preview encodings and quality (previews favour speed over fidelity)
+PREVIEW_FORMATS = {"jpeg": "JPEG", "webp": "WEBP"}
+PREVIEW_QUALITY = 80
+
+
+def choose_thumbnail(thumbnail_sizes: List[int], max_dimension: int) -> Optional[int]:
+    """
+    Index of the smallest thumbnail at least max_dimension on its longer side, else of
+    the largest one; None when there are no thumbnails.
+    """
+    if not thumbnail_sizes:
+        return None
+    large_enough = [i for i, size in enumerate(thumbnail_sizes) if size >= max_dimension]
+    if large_enough:
+        return min(large_enough, key=lambda i: thumbnail_sizes[i])
+    return max(range(len(thumbnail_sizes)), key=lambda i: thumbnail_sizes[i])
+
+
+def preview_thumbnail_size(source: HeicSource, max_dimension: int) -> Optional[int]:
+    """
+    Longer side of the thumbnail render_preview would decode, or None if it would decode
+    the full primary image. Only parses the container.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    heif_file = pillow_heif.open_heif(source)
+    thumbnail_sizes = heif_file[heif_file.primary_index].info.get("thumbnails") or []
+    index = choose_thumbnail(thumbnail_sizes, max_dimension)
+    return None if index is None else thumbnail_sizes[index]
+
+
+def render_preview(source: HeicSource, max_dimension: int, output_format: str = "jpeg") -> Tuple[bytes, str]:
+    """
+    Render a small preview of the primary image, no larger than max_dimension on either side.
+    Uses the smallest embedded HEIF thumbnail that is large enough (or the largest one
+    available) and only falls back to decoding the full primary image when the file
+    has no thumbnails. Returns the encoded preview and its source ("thumbnail" or "decode").
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    
+    # open_heif only parses the container; pixels are decoded on first access
+    heif_file = pillow_heif.open_heif(source)
+    primary = heif_file[heif_file.primary_index]
+    index = choose_thumbnail(primary.info.get("thumbnails") or [], max_dimension)
+    
+    if index is not None:
+        img = primary.get_thumbnail(index).to_pillow()
+        preview_source = "thumbnail"
+    else:
+        img = primary.to_pillow()
+        preview_source = "decode"
+    
+    # reducing_gap lets Pillow shrink by an integer factor first, then resample the rest
+    img.thumbnail((max_dimension, max_dimension), Image.Resampling.BILINEAR, reducing_gap=2.0)
+    img = flatten_to_rgb(img)
+    
+    output_buffer = io.BytesIO()
+    img.save(output_buffer, PREVIEW_FORMATS[output_format], quality=PREVIEW_QUALITY)
+    return output_buffer.getvalue(), preview_source
+
+
+# EXIF tags reported by inspect_heic
+EXIF_ORIENTATION = 0x0112
+EXIF_DATETIME = 0x0132
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 0x9003
+EXIF_OFFSET_TIME_ORIGINAL = 0x9011
+
+
+def read_exif_basics(exif_data: Optional[bytes]) -> Optional[dict]:
+    """
+    Capture time (DateTimeOriginal, falling back to DateTime) and orientation from raw EXIF.
+    """
+    if not exif_data:
+        return None
+    exif = Image.Exif()
+    try:
+        exif.load(exif_data)
+        exif_ifd = exif.get_ifd(EXIF_IFD)
+    except Exception:
+        return None
+    return {
+        "capture_time": exif_ifd.get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME),
+        "capture_time_offset": exif_ifd.get(EXIF_OFFSET_TIME_ORIGINAL),
+        "orientation": exif.get(EXIF_ORIENTATION),
+    }
+
+
+def inspect_heic(source: HeicSource) -> dict:
+    """
+    Describe a HEIF container from its metadata alone: per-image dimensions, bit depth,
+    alpha, depth/auxiliary images and thumbnails, plus EXIF basics of the primary image.
+    No pixel data is decoded, so this takes milliseconds regardless of image size.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    
+    # convert_hdr_to_8bit=False so bit_depth reports what is stored, not what we'd decode to
+    heif_file = pillow_heif.open_heif(source, convert_hdr_to_8bit=False)
+    images = []
+    for index, heif_image in enumerate(heif_file, start=1):
+        width, height = heif_image.size
+        images.append({
+            "index": index,
+            "primary": bool(heif_image.info.get("primary")),
+            "width": width,
+            "height": height,
+            "bit_depth": heif_image.info.get("bit_depth"),
+            "has_alpha": heif_image.has_alpha,
+            "depth_images": len(heif_image.info.get("depth_images") or []),
+            "thumbnails": list(heif_image.info.get("thumbnails") or []),
+            "auxiliary": sorted(heif_image.info.get("aux") or {}),
+        })
+    
+    primary = heif_file[heif_file.primary_index]
+    primary_info = images[heif_file.primary_index]
+    return {
+        "mimetype": heif_file.mimetype,
+        "width": primary_info["width"],
+        "height": primary_info["height"],
+        "bit_depth": primary_info["bit_depth"],
+        "image_count": len(images),
+        "has_alpha": primary_info["has_alpha"],
+        "has_depth": any(image["depth_images"] for image in images),
+        "has_thumbnail": any(image["thumbnails"] for image in images),
+        "exif": read_exif_basics(primary.info.get("exif")),
+        "images": images,
+    }
@@ -0,0 +1,129 @@
+from PIL import features
+from typing import Iterator, NamedTuple, Optional, Tuple
+import struct
+
+# ISO-BMFF brands of HEVC-coded HEIF images and sequences, plus the structural
+# HEIF brands that iPhones and most encoders list as major or compatible brands
+HEIF_BRANDS = {"heic", "heix", "heim", "heis", "hevc", "hevx", "hevm", "hevs", "mif1", "mif2", "msf1"}
+
+# AV1-coded HEIF, only accepted when Pillow was built with its AVIF plugin
+AVIF_BRANDS = {"avif", "avis"}
+
+SUPPORTED_BRANDS = HEIF_BRANDS | (AVIF_BRANDS if features.check("avif") else set())
+
+# Bytes needed to sniff a file: the ftyp box comes first and is a few dozen bytes long
+SNIFF_BYTES = 256
+
+
+def read_ftyp_brands(header: bytes) -> Optional[list]:
+    """
+    Return [major_brand, *compatible_brands] from a leading ISO-BMFF ftyp box, or None
+    if header doesn't start with one. Brands past the end of header are ignored.
+    """
+    if len(header) < 16 or header[4:8] != b"ftyp":
+        return None
+
+    box_size = struct.unpack(">I", header[:4])[0]
+    if box_size < 16:
+        return None
+
+    # major_brand, minor_version, then compatible brands up to the end of the box
+    end = min(box_size, len(header))
+    brands = [header[8:12]] + [header[offset:offset + 4] for offset in range(16, end - 3, 4)]
+    return [brand.decode("latin-1") for brand in brands]
+
+
+def is_heif_header(header: bytes) -> bool:
+    """
+    True if header starts with an ftyp box naming a supported HEIF brand.
+    """
+    brands = read_ftyp_brands(header)
+    return brands is not None and any(brand in SUPPORTED_BRANDS for brand in brands)
+
+
+class HeifImageInfo(NamedTuple):
+    """
+    Size of the largest image in a HEIF file, read from its ispe/pixi properties.
+    """
+    width: int
+    height: int
+    bit_depth: int
+
+    @property
+    def pixels(self) -> int:
+        return self.width * self.height
+
+    @property
+    def decoded_bytes(self) -> int:
+        """
+        Estimated peak memory to decode the image: the decoder's YCbCr planes plus
+        Pillow's RGBA frame, at one byte per sample up to 8 bits and two above.
+        """
+        bytes_per_sample = 1 if self.bit_depth <= 8 else 2
+        return self.pixels * bytes_per_sample * (3 + 4)
+
+
+def iter_boxes(data: bytes, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[bytes, int, int]]:
+    """
+    Yield (box type, payload start, payload end) for the ISO-BMFF boxes in data[start:end].
+    Stops at the first truncated or malformed box.
+    """
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack(">I4s", data[offset:offset + 8])
+        header_size = 8
+        if size == 1:
+            if offset + 16 > end:
+                return
+            size = struct.unpack(">Q", data[offset + 8:offset + 16])[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            return
+        yield box_type, offset + header_size, offset + size
+        offset += size
+
+
+def find_box(data: bytes, box_type: bytes, start: int, end: int) -> Optional[Tuple[int, int]]:
+    for found_type, payload_start, payload_end in iter_boxes(data, start, end):
+        if found_type == box_type:
+            return payload_start, payload_end
+    return None
+
+
+def read_heif_info(data: bytes) -> Optional[HeifImageInfo]:
+    """
+    Read image dimensions and bit depth from the meta box without decoding any pixels.
+    Uses the largest ispe (image spatial extents) and pixi (bits per channel) properties,
+    which covers grid images and every image of a collection. Returns None when the
+    file has no usable ispe property.
+    """
+    meta = find_box(data, b"meta", 0, len(data))
+    if meta is None:
+        return None
+    # meta is a full box: skip version and flags
+    iprp = find_box(data, b"iprp", meta[0] + 4, meta[1])
+    if iprp is None:
+        return None
+    ipco = find_box(data, b"ipco", *iprp)
+    if ipco is None:
+        return None
+
+    width = height = 0
+    bit_depth = 8
+    for box_type, payload_start, payload_end in iter_boxes(data, *ipco):
+        if box_type == b"ispe" and payload_end - payload_start >= 12:
+            box_width, box_height = struct.unpack(">II", data[payload_start + 4:payload_start + 12])
+            if box_width * box_height > width * height:
+                width, height = box_width, box_height
+        elif box_type == b"pixi" and payload_end - payload_start >= 5:
+            channels = data[payload_start + 4]
+            depths = data[payload_start + 5:min(payload_start + 5 + channels, payload_end)]
+            if depths:
+                bit_depth = max(bit_depth, max(depths))
+
+    if not width or not height:
+        return None
+    return HeifImageInfo(width, height, bit_depth)
@@ -0,0 +1,37 @@
+"""
+Standalone conversion worker for the MongoDB work queue.
+
+Pulls conversion tasks submitted by any replica and converts them on this machine's
+worker pool without serving HTTP, so conversion capacity can be scaled separately
+from the API front ends:
+
+    WORK_QUEUE_ENABLED=true WORK_QUEUE_WORKERS=8 python queue_worker.py
+"""
+import asyncio
+import logging
+
+from server import WORK_QUEUE_WORKERS, conversion_executor, handle_conversion_task, work_queue
+from work_queue import QueueWorker
+
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    if work_queue is None:
+        raise SystemExit("Set WORK_QUEUE_ENABLED=true to run a queue worker")
+
+    await work_queue.ensure_indexes()
+    worker = QueueWorker(work_queue, handle_conversion_task, max(1, WORK_QUEUE_WORKERS))
+    logger.info(f"Queue worker {worker.worker_id} started with concurrency {worker.concurrency}")
+    try:
+        await worker.run_forever()
+    finally:
+        worker.stop()
+        conversion_executor.shutdown()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
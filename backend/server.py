@@ -1,29 +1,57 @@
-from fastapi import FastAPI, APIRouter, UploadFile, File, Form, HTTPException, Depends
+from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Depends, Request, WebSocket, WebSocketDisconnect
 from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import ClientDisconnect
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 import uuid
 from datetime import datetime, timezone
-import tempfile
 import shutil
-from PIL import Image
-import pillow_heif
-import img2pdf
-import zipfile
-import io
+from collections import deque
+import asyncio
 import secrets
 import json
+import time
+import struct
 from passlib.hash import bcrypt
 
-# Register HEIF opener with Pillow
-pillow_heif.register_heif_opener()
+from converter import (
+    ConversionOptions,
+    ENCODER_PROFILES,
+    ENCODER_SPEEDS,
+    JPEG_SUBSAMPLING,
+    OUTPUT_FORMATS,
+    PDF_MODES,
+    PREVIEW_FORMATS,
+    assemble_pdf,
+    convert_heic_images,
+    convert_heic_to_formats,
+    convert_heic_to_pdf_page,
+    inspect_heic,
+    preview_thumbnail_size,
+    render_preview,
+)
+from conversion_executor import (
+    PRIORITY_CLASSES,
+    ConversionExecutor,
+    conversion_priority,
+    conversion_started,
+    map_ordered,
+)
+from admission import DecodeAdmission
+from conversion_cache import ConversionCache, content_digest
+from conversion_jobs import ConversionJob, JobFile, JobStore, utc_now
+from heif_header import SNIFF_BYTES, HeifImageInfo, is_heif_header
+from single_flight import SingleFlight
+from upload_spool import SpooledForm, SpooledUpload, UploadLimits, check_multipart_request, iter_multipart, spool_form
+from work_queue import QueueWorker, WorkQueue
+from zipstream import ZipStreamWriter
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -33,6 +61,46 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+# Worker pool for CPU-bound conversions (keeps the event loop responsive)
+conversion_executor = ConversionExecutor.from_env()
+
+# Conversions a single batch request may run at once (the executor also enforces a global cap)
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', conversion_executor.max_workers))
+
+# Short-lived cache of conversion outputs, keyed by input hash + format + options
+conversion_cache = ConversionCache.from_env()
+
+# Per-file / per-request upload size caps enforced while the body streams in
+upload_limits = UploadLimits.from_env()
+
+# Global budget of estimated decode memory, sized from HEIF headers before decoding
+decode_admission = DecodeAdmission.from_env()
+
+# Identical conversions already running are shared instead of decoded again
+conversion_flights = SingleFlight()
+
+# Asynchronous conversion jobs, kept on local disk until their results expire
+job_store = JobStore.from_env()
+
+# Files a WebSocket client may have in flight before it has to wait for results
+WS_CREDITS = int(os.environ.get('WS_CREDITS', BATCH_CONCURRENCY * 2))
+
+# Largest WebSocket message the ASGI server accepts; must match uvicorn's --ws-max-size
+# (16 MiB by default), which closes the whole connection on a bigger message
+WS_MAX_MESSAGE_BYTES = int(os.environ.get('WS_MAX_MESSAGE_BYTES', 16 * 1024 * 1024))
+# Room left in each message for the frame's length prefix and JSON header
+WS_FRAME_HEADER_BYTES = 64 * 1024
+WS_MAX_FILE_BYTES = max(0, min(upload_limits.max_file_bytes, WS_MAX_MESSAGE_BYTES - WS_FRAME_HEADER_BYTES))
+
+# Seconds between keep-alive comments on idle job event streams
+SSE_KEEPALIVE_SECONDS = 15
+
+# Optional MongoDB work queue: job files are converted by whichever replica's worker claims them
+work_queue = WorkQueue.from_env(db) if os.environ.get('WORK_QUEUE_ENABLED', 'false').lower() == 'true' else None
+
+# Work queue tasks this process converts at once (0 = submit tasks but leave them to other replicas)
+WORK_QUEUE_WORKERS = int(os.environ.get('WORK_QUEUE_WORKERS', BATCH_CONCURRENCY))
+
 # Create the main app without a prefix
 app = FastAPI()
 
@@ -81,50 +149,203 @@ async def get_status_checks():
     return status_checks
 
 
-def convert_heic_to_format(input_path: str, output_format: str) -> bytes:
+def conversion_options_from_form(form: SpooledForm) -> ConversionOptions:
     """
-    Convert HEIC file to specified format and return bytes.
+    Validate encoder form fields shared by the convert endpoints and build ConversionOptions.
     """
-    # Open HEIC image
-    img = Image.open(input_path)
+    pdf_mode = form.get('pdf_mode', 'jpeg').lower()
+    profile = form.get('profile', 'balanced')
+    quality = form.get_int('quality')
+    optimize = form.get_bool('optimize')
+    progressive = form.get_bool('progressive')
+    subsampling = form.get('subsampling')
+    compress_level = form.get_int('compress_level')
+    strip_metadata = form.get_bool('strip_metadata')
+    speed = form.get('speed')
+    max_width = form.get_int('max_width')
+    max_height = form.get_int('max_height')
+    scale = form.get_float('scale')
+    
+    if pdf_mode not in PDF_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid PDF mode. Supported modes: {', '.join(PDF_MODES)}"
+        )
+    
+    profile = profile.lower()
+    if profile not in ENCODER_PROFILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid encoder profile. Supported profiles: {', '.join(ENCODER_PROFILES)}"
+        )
+    
+    if quality is not None and not 1 <= quality <= 100:
+        raise HTTPException(
+            status_code=400,
+            detail="Quality must be between 1 and 100"
+        )
+    
+    if subsampling is not None and subsampling not in JPEG_SUBSAMPLING:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid subsampling. Supported values: {', '.join(JPEG_SUBSAMPLING)}"
+        )
+    
+    if speed is not None:
+        speed = speed.lower()
+        if speed not in ENCODER_SPEEDS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid encoder speed. Supported speeds: {', '.join(ENCODER_SPEEDS)}"
+            )
+    
+    if compress_level is not None and not 0 <= compress_level <= 9:
+        raise HTTPException(
+            status_code=400,
+            detail="compress_level must be between 0 and 9"
+        )
     
-    # Convert RGBA to RGB if necessary (for JPEG)
-    if img.mode in ('RGBA', 'LA') and output_format in ['jpeg', 'jpg']:
-        background = Image.new('RGB', img.size, (255, 255, 255))
-        background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-        img = background
+    if (max_width is not None and max_width < 1) or (max_height is not None and max_height < 1):
+        raise HTTPException(
+            status_code=400,
+            detail="max_width and max_height must be positive"
+        )
+    
+    if scale is not None and not 0 < scale <= 1:
+        raise HTTPException(
+            status_code=400,
+            detail="Scale must be greater than 0 and at most 1"
+        )
+    
+    return ConversionOptions(
+        pdf_mode=pdf_mode,
+        profile=profile,
+        quality=quality,
+        optimize=optimize,
+        progressive=progressive,
+        subsampling=subsampling,
+        compress_level=compress_level,
+        strip_metadata=strip_metadata,
+        speed=speed,
+        max_width=max_width,
+        max_height=max_height,
+        scale=scale
+    )
+
+
+def parse_output_formats(output_format: str) -> List[str]:
+    """
+    Parse a single output format or a comma-separated list (e.g. "jpeg,pdf").
+    Formats that would produce the same file extension are only kept once.
+    """
+    output_formats = []
+    extensions = set()
+    for fmt in output_format.lower().split(','):
+        fmt = fmt.strip()
+        if fmt not in OUTPUT_FORMATS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid output format. Supported formats: {', '.join(OUTPUT_FORMATS)}"
+            )
+        if output_extension(fmt) not in extensions:
+            extensions.add(output_extension(fmt))
+            output_formats.append(fmt)
+    return output_formats
+
+
+def output_extension(output_format: str) -> str:
+    return 'jpg' if output_format == 'jpeg' else output_format
+
+
+def output_media_type(output_format: str) -> str:
+    return f"image/{output_extension(output_format)}" if output_format != 'pdf' else "application/pdf"
+
+
+async def run_conversion(
+    content: bytes,
+    output_formats: List[str],
+    options: ConversionOptions
+) -> Dict[str, bytes]:
+    """
+    Convert into every requested format with a single decode on the worker pool.
+    Outputs already in the cache are reused, and identical concurrent requests share
+    one computation.
+    """
+    # hashlib releases the GIL, so hash large uploads off the event loop
+    digest = await asyncio.to_thread(content_digest, content)
+    cache_keys = {fmt: ConversionCache.make_key(digest, fmt, options) for fmt in output_formats}
     
-    # Generate output
-    output_extension = 'jpg' if output_format == 'jpeg' else output_format
+    results = {}
+    if conversion_cache.enabled:
+        for fmt, cache_key in cache_keys.items():
+            cached = await conversion_cache.get(cache_key)
+            if cached is not None:
+                results[fmt] = cached
     
-    if output_format == 'pdf':
-        # Convert to PDF using img2pdf
-        # First save as PNG temporarily
-        temp_png_fd, temp_png_path = tempfile.mkstemp(suffix='.png')
-        os.close(temp_png_fd)
+    missing = [fmt for fmt in output_formats if fmt not in results]
+    if missing:
+        async def convert():
+            async with decode_admission.admit(content):
+                outputs = await conversion_executor.run(convert_heic_to_formats, content, missing, options)
+            for fmt, file_content in outputs.items():
+                await conversion_cache.put(cache_keys[fmt], file_content)
+            return outputs
         
-        try:
-            if img.mode in ('RGBA', 'LA'):
-                img_rgb = Image.new('RGB', img.size, (255, 255, 255))
-                img_rgb.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                img_rgb.save(temp_png_path, 'PNG')
-            else:
-                img.save(temp_png_path, 'PNG')
-            
-            # Convert PNG to PDF
-            pdf_bytes = img2pdf.convert(temp_png_path)
-            return pdf_bytes
-        finally:
-            # Clean up temporary PNG
-            if os.path.exists(temp_png_path):
-                os.unlink(temp_png_path)
-            img.close()
-    else:
-        # Save as JPEG or PNG to bytes
-        output_buffer = io.BytesIO()
-        img.save(output_buffer, output_format.upper())
-        img.close()
-        return output_buffer.getvalue()
+        flight_key = ConversionCache.make_key(digest, ','.join(missing), options)
+        results.update(await conversion_flights.do(flight_key, convert))
+    
+    return results
+
+
+async def run_container_conversion(
+    content: bytes,
+    output_formats: List[str],
+    options: ConversionOptions,
+    include_auxiliary: bool
+) -> List[Tuple[str, Dict[str, bytes]]]:
+    """
+    Convert every image in a HEIF container in one decode session on the worker pool.
+    Identical concurrent requests share one computation.
+    """
+    digest = await asyncio.to_thread(content_digest, content)
+    flight_key = ConversionCache.make_key(
+        digest, f"all-images|{include_auxiliary}|{','.join(output_formats)}", options
+    )
+    
+    async def convert():
+        async with decode_admission.admit(content):
+            return await conversion_executor.run(
+                convert_heic_images, content, output_formats, options, include_auxiliary
+            )
+    
+    return await conversion_flights.do(flight_key, convert)
+
+
+async def convert_to_entries(
+    filename: str,
+    content: bytes,
+    output_formats: List[str],
+    options: ConversionOptions,
+    all_images: bool = False,
+    include_auxiliary: bool = False
+) -> List[Tuple[str, bytes]]:
+    """
+    Convert one upload and return (output filename, bytes) pairs for a ZIP archive:
+    one per format, and with all_images one per format for every image in the container
+    (named <name>_<index>.<ext>).
+    """
+    base_filename = Path(filename).stem
+    
+    if all_images:
+        images = await run_container_conversion(content, output_formats, options, include_auxiliary)
+        return [
+            (f"{base_filename}_{label}.{output_extension(fmt)}", outputs[fmt])
+            for label, outputs in images
+            for fmt in output_formats
+        ]
+    
+    outputs = await run_conversion(content, output_formats, options)
+    return [(f"{base_filename}.{output_extension(fmt)}", outputs[fmt]) for fmt in output_formats]
 
 
 @api_router.options("/convert")
@@ -132,172 +353,1071 @@ async def convert_options():
     """Handle CORS preflight requests"""
     return {"detail": "OK"}
 
-@api_router.post("/convert")
-async def convert_heic(
-    file: UploadFile = File(...),
-    output_format: str = Form("jpeg")
-):
+def shed_if_queue_full():
     """
-    Convert HEIC file to JPEG, PNG, or PDF format.
-    Automatically deletes the uploaded file after conversion.
+    Fail fast with 503 + Retry-After when the conversion queue is full, instead of
+    queueing work that would only time out at the proxy.
     """
-    # Validate output format
-    valid_formats = ["jpeg", "jpg", "png", "pdf"]
-    output_format = output_format.lower()
-    
-    if output_format not in valid_formats:
+    if conversion_executor.queue_full():
         raise HTTPException(
-            status_code=400,
-            detail=f"Invalid output format. Supported formats: {', '.join(valid_formats)}"
+            status_code=503,
+            detail="Server is busy, please retry shortly",
+            headers={"Retry-After": str(conversion_executor.retry_after())}
         )
-    
-    # Validate file extension
-    if not file.filename.lower().endswith(('.heic', '.heif')):
+
+
+def require_uploads(form: SpooledForm, field_name: str) -> List[SpooledUpload]:
+    """
+    Uploaded files for a required form field (422 like FastAPI's File(...) when missing).
+    """
+    uploads = form.files_for(field_name)
+    if not uploads:
         raise HTTPException(
-            status_code=400,
-            detail="File must be in HEIC or HEIF format"
+            status_code=422,
+            detail=f"Form field '{field_name}' is required"
         )
+    return uploads
+
+
+@api_router.post("/convert")
+async def convert_heic(request: Request):
+    """
+    Convert HEIC file to JPEG, PNG, PDF, WebP or AVIF format.
+    Form fields: file, output_format, all_images, include_auxiliary and the encoder options below.
+    output_format may list several formats (e.g. "jpeg,pdf"): the image is decoded once
+    and a ZIP with one file per format is returned.
+    all_images=true converts every image in the container (bursts, collections) and
+    returns them as a ZIP; include_auxiliary=true adds depth and auxiliary images.
+    Output can be downscaled with max_width/max_height/scale before encoding.
+    Encoder settings come from a named profile (fast, balanced, smallest) with optional
+    per-request overrides (quality, optimize, progressive, subsampling, compress_level, strip_metadata,
+    and speed=fast|balanced|slow for WebP/AVIF).
+    Source EXIF (including GPS location) and ICC metadata are dropped unless strip_metadata=false.
+    PDF pages are embedded as JPEG (pdf_mode=jpeg, at the given quality) or lossless PNG (pdf_mode=lossless).
+    The upload is streamed into a size-capped spool (memory, then a temp file) and
+    rejected with 413 as soon as it exceeds MAX_UPLOAD_FILE_BYTES, or with 415 as soon as
+    its first bytes show it isn't a HEIF file.
+    Images above MAX_IMAGE_PIXELS are rejected with 413, and conversions that don't fit the
+    decode memory budget within ADMISSION_MAX_WAIT get 503 with Retry-After. When the
+    conversion queue is full (CONVERSION_QUEUE_DEPTH) the request is shed with 503 up front.
+    """
+    shed_if_queue_full()
+    form = await spool_form(request, upload_limits)
+    try:
+        file = require_uploads(form, 'file')[0]
+        output_format = form.get('output_format', 'jpeg')
+        all_images = form.get_bool('all_images', False)
+        include_auxiliary = form.get_bool('include_auxiliary', False)
+        options = conversion_options_from_form(form)
+        
+        # Validate output format(s)
+        output_formats = parse_output_formats(output_format)
+        
+        # Validate file extension
+        if not file.filename.lower().endswith(('.heic', '.heif')):
+            raise HTTPException(
+                status_code=400,
+                detail="File must be in HEIC or HEIF format"
+            )
+        
+        # The queue may have filled up while the upload was streaming in
+        shed_if_queue_full()
+        
+        try:
+            content = file.read()
+            
+            # Generate output filename
+            base_filename = Path(file.filename).stem
+            
+            if all_images or len(output_formats) > 1:
+                # One decode session, several outputs: bundle them in a ZIP
+                entries = await convert_to_entries(
+                    file.filename, content, output_formats, options, all_images, include_auxiliary
+                )
+                zip_writer = ZipStreamWriter()
+                zip_content = b"".join(
+                    zip_writer.add(entry_name, entry_content) for entry_name, entry_content in entries
+                ) + zip_writer.close()
+                return Response(
+                    content=zip_content,
+                    media_type="application/zip",
+                    headers={
+                        "Content-Disposition": f"attachment; filename={base_filename}.zip"
+                    }
+                )
+            
+            # Convert the file on the worker pool (or reuse a cached result)
+            outputs = await run_conversion(content, output_formats, options)
+            
+            output_format = output_formats[0]
+            output_filename = f"{base_filename}.{output_extension(output_format)}"
+            
+            # Return the converted file
+            return Response(
+                content=outputs[output_format],
+                media_type=output_media_type(output_format),
+                headers={
+                    "Content-Disposition": f"attachment; filename={output_filename}"
+                }
+            )
+        
+        except HTTPException:
+            # Admission control rejections (413/503) keep their status
+            raise
+        except Exception as e:
+            logger.error(f"Error converting file: {str(e)}")
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error converting file: {str(e)}"
+            )
+    finally:
+        form.close()
+
+
+@api_router.post("/convert-batch")
+async def convert_heic_batch(request: Request):
+    """
+    Convert multiple HEIC files to JPEG, PNG, PDF, WebP or AVIF format.
+    Form fields: files, output_format, combine_pdf, all_images, include_auxiliary and the
+    encoder options accepted by /convert.
+    Returns a ZIP file containing all converted files, streamed entry by entry,
+    or a single multi-page PDF when output_format=pdf and combine_pdf=true.
+    output_format may list several formats (e.g. "jpeg,pdf"); each file is decoded once
+    and every format is added to the ZIP.
+    all_images=true adds every image of each HEIF container (and, with include_auxiliary=true,
+    its depth and auxiliary images) instead of only the primary image.
+    Uploads are spooled to memory or temp files within MAX_UPLOAD_FILE_BYTES per file and
+    MAX_UPLOAD_REQUEST_BYTES per request, and each is read back only when it is converted.
+    Files whose header isn't HEIF are skipped without being spooled.
+    Returns 503 with Retry-After before reading or converting anything when the conversion
+    queue is full; once a batch is accepted its files wait for the pool instead of being shed.
+    Batch files run at "batch" priority, behind single-file conversions.
+    """
+    conversion_priority.set("batch")
+    shed_if_queue_full()
+    form = await spool_form(request, upload_limits, skip_unsupported=True)
+    uploads = deque()
+    try:
+        files = require_uploads(form, 'files')
+        output_format = form.get('output_format', 'jpeg')
+        combine_pdf = form.get_bool('combine_pdf', False)
+        all_images = form.get_bool('all_images', False)
+        include_auxiliary = form.get_bool('include_auxiliary', False)
+        options = conversion_options_from_form(form)
+        
+        # Validate output format(s)
+        output_formats = parse_output_formats(output_format)
+        
+        if combine_pdf and output_formats != ['pdf']:
+            raise HTTPException(
+                status_code=400,
+                detail="combine_pdf requires output_format=pdf"
+            )
+        
+        if combine_pdf and all_images:
+            raise HTTPException(
+                status_code=400,
+                detail="combine_pdf cannot be combined with all_images"
+            )
+        
+        for file in files:
+            # Validate file extension and content (the ftyp brand was sniffed while spooling)
+            if not file.filename.lower().endswith(('.heic', '.heif')) or file.rejected:
+                logger.warning(f"Skipping non-HEIC file: {file.filename}")
+                continue
+            
+            uploads.append(file)
+        
+        if not uploads:
+            raise HTTPException(
+                status_code=415 if form.rejected_files() else 400,
+                detail="No valid HEIC files found"
+            )
+        
+        shed_if_queue_full()
+        
+        if combine_pdf:
+            try:
+                return await convert_heic_batch_to_pdf(uploads, options)
+            finally:
+                form.close()
+    except BaseException:
+        form.close()
+        raise
     
-    temp_input_path = None
+    async def convert_one(upload):
+        filename, content = upload
+        try:
+            # Convert the file on the worker pool (or reuse cached results)
+            entries = await convert_to_entries(
+                filename, content, output_formats, options, all_images, include_auxiliary
+            )
+            return entries, None
+        except Exception as e:
+            logger.error(f"Error converting batch file {filename}: {str(e)}")
+            return [], f"{filename}: {str(e)}"
     
-    try:
-        # Create temporary file for input HEIC
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.heic') as temp_input:
-            temp_input_path = temp_input.name
-            # Write uploaded file to temp location
-            content = await file.read()
-            temp_input.write(content)
-        
-        # Convert the file
-        file_content = convert_heic_to_format(temp_input_path, output_format)
-        
-        # Delete the input file (as per requirement)
-        if temp_input_path and os.path.exists(temp_input_path):
-            os.unlink(temp_input_path)
-            temp_input_path = None
-        
-        # Generate output filename
-        base_filename = Path(file.filename).stem
-        output_extension = 'jpg' if output_format == 'jpeg' else output_format
-        output_filename = f"{base_filename}.{output_extension}"
-        
-        # Return the converted file
-        return Response(
-            content=file_content,
-            media_type=f"image/{output_extension}" if output_format != 'pdf' else "application/pdf",
-            headers={
-                "Content-Disposition": f"attachment; filename={output_filename}"
-            }
-        )
+    async def stream_zip():
+        """
+        Convert up to BATCH_CONCURRENCY files in parallel and emit ZIP entries in upload
+        order as soon as each is ready.
+        Failures can't change the status code once streaming has started, so they
+        are listed in conversion_errors.txt at the end of the archive.
+        """
+        # The response body is produced outside the handler; keep the batch priority explicit
+        conversion_priority.set("batch")
+        zip_writer = ZipStreamWriter()
+        errors = []
+        
+        try:
+            async for entries, error in map_ordered(convert_one, take_uploads(uploads), BATCH_CONCURRENCY):
+                if error:
+                    errors.append(error)
+                    continue
+                for output_filename, file_content in entries:
+                    yield zip_writer.add(output_filename, file_content)
+            
+            if errors:
+                yield zip_writer.add("conversion_errors.txt", "\n".join(errors).encode("utf-8"))
+            
+            yield zip_writer.close()
+        finally:
+            form.close()
     
+    # Return the ZIP file as it is produced
+    return StreamingResponse(
+        stream_zip(),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f"attachment; filename=converted_files.zip"
+        }
+    )
+
+
+def take_uploads(uploads: deque):
+    """
+    Hand spooled uploads over one at a time as (filename, bytes), closing each spool
+    once read so only the files being converted are held in memory.
+    """
+    while uploads:
+        upload = uploads.popleft()
+        try:
+            yield upload.filename, upload.read()
+        finally:
+            upload.close()
+
+
+async def convert_heic_batch_to_pdf(uploads: deque, options: ConversionOptions) -> Response:
+    """
+    Build one multi-page PDF from a batch, one page per file in upload order.
+    Pages are decoded and encoded in parallel on the worker pool; only the compressed
+    page data is kept until img2pdf assembles the document.
+    """
+    async def encode_page(upload):
+        filename, content = upload
+        try:
+            async with decode_admission.admit(content):
+                return await conversion_executor.run(convert_heic_to_pdf_page, content, options)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Error converting batch file {filename}: {str(e)}")
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error converting {filename}: {str(e)}"
+            )
+    
+    pages = [page async for page in map_ordered(encode_page, take_uploads(uploads), BATCH_CONCURRENCY)]
+    
+    try:
+        pdf_bytes = await conversion_executor.run(assemble_pdf, pages)
     except Exception as e:
-        # Clean up temporary files in case of error
-        if temp_input_path and os.path.exists(temp_input_path):
-            os.unlink(temp_input_path)
-        
-        logger.error(f"Error converting file: {str(e)}")
+        logger.error(f"Error assembling batch PDF: {str(e)}")
         raise HTTPException(
             status_code=500,
-            detail=f"Error converting file: {str(e)}"
+            detail=f"Error converting files: {str(e)}"
         )
+    
+    return Response(
+        content=pdf_bytes,
+        media_type="application/pdf",
+        headers={
+            "Content-Disposition": "attachment; filename=converted_files.pdf"
+        }
+    )
 
 
-@api_router.post("/convert-batch")
-async def convert_heic_batch(
-    files: List[UploadFile] = File(...),
-    output_format: str = Form("jpeg")
-):
+class PipelinedStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse whose body is produced while the request body is still being read.
+    StreamingResponse normally listens for the client disconnecting on receive(), which
+    would swallow the request body messages, so this one only streams; a disconnect
+    surfaces as a failed send or as ClientDisconnect from request.stream() instead.
+    """
+    
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+def form_from_values(values: dict) -> SpooledForm:
+    """
+    A file-less SpooledForm holding values that didn't come from a multipart body
+    (query parameters, WebSocket headers), so the form validation can be reused.
+    JSON booleans are spelled the way form fields send them.
+    """
+    form = SpooledForm()
+    form.fields = {
+        name: str(value).lower() if isinstance(value, bool) else str(value)
+        for name, value in values.items() if value is not None
+    }
+    return form
+
+
+@api_router.post("/convert-batch/stream")
+async def convert_heic_batch_pipelined(request: Request):
+    """
+    Convert multiple HEIC files while they are still being uploaded.
+    The multipart body (files fields) is parsed as it arrives and each file is handed to the
+    worker pool as soon as its part is complete, so conversion overlaps the upload instead of
+    starting after it. Converted files are streamed back in a ZIP in completion order.
+    Conversion settings are query parameters (output_format, all_images, include_auxiliary
+    and the encoder options accepted by /convert) because they have to be known before the
+    first file arrives; form fields in the body are ignored. combine_pdf isn't supported.
+    At most BATCH_CONCURRENCY files are converting or waiting to be sent at once; further
+    parts wait in the request body until a slot frees up, so a client that doesn't read the
+    response stalls its own upload instead of piling outputs up in memory. Once streaming
+    has started, skipped files,
+    failures and upload errors (size limits, a truncated body) are listed in
+    conversion_errors.txt at the end of the archive.
+    """
+    conversion_priority.set("batch")
+    form = form_from_values(dict(request.query_params))
+    output_formats = parse_output_formats(form.get('output_format', 'jpeg'))
+    all_images = form.get_bool('all_images', False)
+    include_auxiliary = form.get_bool('include_auxiliary', False)
+    options = conversion_options_from_form(form)
+    
+    # Reject what the headers already tell us about before the response starts
+    check_multipart_request(request, upload_limits)
+    shed_if_queue_full()
+    
+    # (entries, error, holds_slot) per file as conversions finish; None once the upload is done
+    results = asyncio.Queue()
+    slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+    conversions = set()
+    
+    async def convert_part(filename: str, content: bytes):
+        # The slot is held until stream_zip has sent the outputs, not just until they exist
+        try:
+            entries = await convert_to_entries(
+                filename, content, output_formats, options, all_images, include_auxiliary
+            )
+            results.put_nowait((entries, None, True))
+        except Exception as e:
+            logger.error(f"Error converting batch file {filename}: {str(e)}")
+            results.put_nowait(([], f"{filename}: {str(e)}", True))
+    
+    async def read_parts():
+        """
+        Start a conversion for every file part as soon as it has been received.
+        """
+        accepted = 0
+        try:
+            async for part in iter_multipart(request, upload_limits, skip_unsupported=True):
+                if not isinstance(part, SpooledUpload):
+                    continue
+                try:
+                    if part.field_name != 'files':
+                        continue
+                    if not part.filename.lower().endswith(('.heic', '.heif')) or part.rejected:
+                        logger.warning(f"Skipping non-HEIC file: {part.filename}")
+                        results.put_nowait(([], f"{part.filename}: not a HEIC or HEIF file", False))
+                        continue
+                    content = part.read()
+                finally:
+                    part.close()
+                
+                # Stop reading the body while every slot is busy converting or sending
+                await slots.acquire()
+                accepted += 1
+                conversion = asyncio.ensure_future(convert_part(part.filename, content))
+                conversions.add(conversion)
+                conversion.add_done_callback(conversions.discard)
+            
+            if not accepted:
+                results.put_nowait(([], "No valid HEIC files found", False))
+        except HTTPException as e:
+            results.put_nowait(([], f"Upload aborted: {e.detail}", False))
+        except ClientDisconnect:
+            logger.warning("Client disconnected during a pipelined batch upload")
+            return
+        
+        await asyncio.gather(*conversions)
+        results.put_nowait(None)
+    
+    async def stream_zip():
+        # The response body is produced outside the handler; keep the batch priority explicit
+        conversion_priority.set("batch")
+        reader = asyncio.ensure_future(read_parts())
+        zip_writer = ZipStreamWriter()
+        errors = []
+        
+        try:
+            while True:
+                result_task = asyncio.ensure_future(results.get())
+                done, _ = await asyncio.wait({result_task, reader}, return_when=asyncio.FIRST_COMPLETED)
+                if result_task not in done:
+                    # The reader stopped without finishing the batch (client gone or a bug)
+                    result_task.cancel()
+                    reader.result()
+                    return
+                result = result_task.result()
+                if result is None:
+                    break
+                entries, error, holds_slot = result
+                if error:
+                    errors.append(error)
+                else:
+                    for output_filename, file_content in entries:
+                        # Resumes once the transport has taken the chunk
+                        yield zip_writer.add(output_filename, file_content)
+                if holds_slot:
+                    slots.release()
+            
+            if errors:
+                yield zip_writer.add("conversion_errors.txt", "\n".join(errors).encode("utf-8"))
+            
+            yield zip_writer.close()
+        finally:
+            reader.cancel()
+            for conversion in list(conversions):
+                conversion.cancel()
+    
+    return PipelinedStreamingResponse(
+        stream_zip(),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": "attachment; filename=converted_files.zip"
+        }
+    )
+
+
+@api_router.post("/preview")
+async def preview_heic(request: Request):
     """
-    Convert multiple HEIC files to JPEG, PNG, or PDF format.
-    Returns a ZIP file containing all converted files.
+    Return a small JPEG or WebP preview of a HEIC file, no larger than max_dimension.
+    Form fields: file, max_dimension (default 256) and output_format (jpeg or webp).
+    Uses the embedded HEIF thumbnail when present instead of decoding the full image.
     """
-    # Validate output format
-    valid_formats = ["jpeg", "jpg", "png", "pdf"]
-    output_format = output_format.lower()
+    form = await spool_form(request, upload_limits)
+    try:
+        file = require_uploads(form, 'file')[0]
+        max_dimension = form.get_int('max_dimension', 256)
+        output_format = form.get('output_format', 'jpeg').lower()
+        
+        if output_format not in PREVIEW_FORMATS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid preview format. Supported formats: {', '.join(PREVIEW_FORMATS)}"
+            )
+        
+        if not 16 <= max_dimension <= 1024:
+            raise HTTPException(
+                status_code=400,
+                detail="max_dimension must be between 16 and 1024"
+            )
+        
+        # Validate file extension
+        if not file.filename.lower().endswith(('.heic', '.heif')):
+            raise HTTPException(
+                status_code=400,
+                detail="File must be in HEIC or HEIF format"
+            )
+        
+        try:
+            content = file.read()
+            # Only the chosen thumbnail is decoded when there is one: reserve memory for
+            # that (decoded to 8 bits per sample) rather than for the full-size image
+            thumbnail_size = await asyncio.to_thread(preview_thumbnail_size, content, max_dimension)
+            if thumbnail_size:
+                admission = decode_admission.admit_image(HeifImageInfo(thumbnail_size, thumbnail_size, 8))
+            else:
+                admission = decode_admission.admit(content)
+            async with admission:
+                preview_content, preview_source = await conversion_executor.run(
+                    render_preview, content, max_dimension, output_format
+                )
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Error creating preview: {str(e)}")
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error creating preview: {str(e)}"
+            )
+    finally:
+        form.close()
     
-    if output_format not in valid_formats:
+    return Response(
+        content=preview_content,
+        media_type=f"image/{output_format}",
+        headers={
+            "X-Preview-Source": preview_source
+        }
+    )
+
+
+def pack_frame(header: dict, payload: bytes = b"") -> bytes:
+    """
+    Binary WebSocket frame: 4-byte big-endian header length, JSON header, then payload.
+    """
+    header_bytes = json.dumps(header).encode("utf-8")
+    return struct.pack(">I", len(header_bytes)) + header_bytes + payload
+
+
+def unpack_frame(frame: bytes) -> Tuple[dict, bytes]:
+    if len(frame) < 4:
+        raise ValueError("Frame is shorter than its length prefix")
+    header_length = struct.unpack(">I", frame[:4])[0]
+    if 4 + header_length > len(frame):
+        raise ValueError("Frame header length exceeds the frame size")
+    header = json.loads(frame[4:4 + header_length])
+    if not isinstance(header, dict):
+        raise ValueError("Frame header must be a JSON object")
+    return header, frame[4 + header_length:]
+
+
+async def convert_websocket_file(header: dict, content: bytes) -> List[Tuple[str, bytes]]:
+    """
+    Validate and convert one file received over the WebSocket. The header carries the
+    same fields as the /convert form (output_format, all_images, encoder options, ...).
+    """
+    if len(content) > WS_MAX_FILE_BYTES:
         raise HTTPException(
-            status_code=400,
-            detail=f"Invalid output format. Supported formats: {', '.join(valid_formats)}"
+            status_code=413,
+            detail=f"File exceeds the maximum WebSocket file size of {WS_MAX_FILE_BYTES} bytes"
         )
     
-    if not files or len(files) == 0:
+    if not is_heif_header(content[:SNIFF_BYTES]):
         raise HTTPException(
-            status_code=400,
-            detail="No files provided"
+            status_code=415,
+            detail="File is not a HEIC or HEIF image"
         )
     
-    temp_input_paths = []
-    converted_files = []
+    # Reuse the form validation: header values arrive as JSON types instead of strings
+    form = form_from_values(header)
+    output_formats = parse_output_formats(form.get('output_format', 'jpeg'))
+    options = conversion_options_from_form(form)
+    
+    shed_if_queue_full()
+    return await convert_to_entries(
+        str(header.get('filename') or 'image.heic'), content, output_formats, options,
+        form.get_bool('all_images', False), form.get_bool('include_auxiliary', False)
+    )
+
+
+@api_router.websocket("/ws/convert")
+async def convert_websocket(websocket: WebSocket):
+    """
+    Convert many files over one WebSocket connection, concurrently on the worker pool.
+    
+    Client -> server: one binary frame per file (see pack_frame) whose JSON header has an
+    "id" chosen by the client, "filename" and any /convert form fields.
+    Server -> client:
+      {"type": "ready", "credits": N, ...} once, on connect;
+      a binary "result" frame per output ({"type", "id", "name", "media_type", "size"} + bytes);
+      then {"type": "done", "id", "outputs", "credits": 1}, or {"type": "error", "id",
+      "status", "detail", "credits": 1} if the file failed.
+    Flow control is credit based: each file costs one credit and every done/error returns
+    it. Sending a file with no credits left closes the connection with code 1008.
+    Results arrive in completion order, not submission order. The ready message advertises
+    max_file_bytes, the smaller of MAX_UPLOAD_FILE_BYTES and what fits in one message of
+    WS_MAX_MESSAGE_BYTES (uvicorn --ws-max-size); bigger files get a per-file 413 as long
+    as their frame still fits in a message, while a frame over the server's message limit
+    closes the connection.
+    """
+    await websocket.accept()
+    send_lock = asyncio.Lock()
+    conversions = set()
+    in_flight = 0
+    
+    async def send(message):
+        # Conversions finish concurrently; keep each result frame and its "done" in one piece
+        async with send_lock:
+            if isinstance(message, bytes):
+                await websocket.send_bytes(message)
+            else:
+                await websocket.send_json(message)
+    
+    async def finish(message: dict):
+        nonlocal in_flight
+        in_flight -= 1
+        await send({**message, "credits": 1})
+    
+    async def convert_frame(frame: bytes):
+        file_id = None
+        try:
+            header, content = unpack_frame(frame)
+            file_id = header.get('id')
+            entries = await convert_websocket_file(header, content)
+        except HTTPException as e:
+            await finish({"type": "error", "id": file_id, "status": e.status_code, "detail": e.detail})
+            return
+        except ValueError as e:
+            await finish({"type": "error", "id": file_id, "status": 400, "detail": f"Invalid frame: {str(e)}"})
+            return
+        except Exception as e:
+            logger.error(f"Error converting WebSocket file {file_id}: {str(e)}")
+            await finish({"type": "error", "id": file_id, "status": 500, "detail": f"Error converting file: {str(e)}"})
+            return
+        
+        for output_filename, file_content in entries:
+            await send(pack_frame({
+                "type": "result",
+                "id": file_id,
+                "name": output_filename,
+                "media_type": output_media_type(Path(output_filename).suffix[1:]),
+                "size": len(file_content),
+            }, file_content))
+        await finish({"type": "done", "id": file_id, "outputs": len(entries)})
+    
+    try:
+        await send({
+            "type": "ready",
+            "credits": WS_CREDITS,
+            "max_file_bytes": WS_MAX_FILE_BYTES,
+            "max_message_bytes": WS_MAX_MESSAGE_BYTES,
+            "output_formats": OUTPUT_FORMATS,
+        })
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is None:
+                await send({"type": "error", "id": None, "status": 400, "detail": "Files must be sent as binary frames"})
+                continue
+            if in_flight >= WS_CREDITS:
+                await websocket.close(code=1008, reason="No credits left")
+                break
+            
+            in_flight += 1
+            task = asyncio.create_task(convert_frame(message["bytes"]))
+            conversions.add(task)
+            task.add_done_callback(conversions.discard)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # Client went away: drop the conversions nobody will receive
+        for task in conversions:
+            task.cancel()
+
+
+async def inspect_upload(upload: SpooledUpload) -> dict:
+    """
+    Header metadata for one spooled upload, parsed off the event loop without decoding pixels.
+    """
+    # Parsing is quick, so it doesn't queue behind conversions on the worker pool
+    return await asyncio.to_thread(inspect_heic, upload.read())
+
+
+@api_router.post("/inspect")
+async def inspect_heic_file(request: Request):
+    """
+    Return metadata of a HEIC file as JSON without converting it: dimensions, bit depth,
+    image count, alpha, depth images, thumbnails and EXIF capture time/orientation,
+    plus the same details for every image in the container.
+    Form field: file.
+    """
+    form = await spool_form(request, upload_limits)
+    try:
+        file = require_uploads(form, 'file')[0]
+        try:
+            metadata = await inspect_upload(file)
+        except Exception as e:
+            logger.error(f"Error inspecting file: {str(e)}")
+            raise HTTPException(
+                status_code=422,
+                detail=f"Could not read HEIF metadata: {str(e)}"
+            )
+    finally:
+        form.close()
+    
+    return {"filename": file.filename, **metadata}
+
+
+@api_router.post("/inspect-batch")
+async def inspect_heic_batch(request: Request):
+    """
+    Return metadata for several HEIC files (form field: files) as {"files": [...]}
+    in upload order. Files that aren't HEIF or can't be parsed get an "error" entry
+    instead of failing the whole request.
+    """
+    form = await spool_form(request, upload_limits, skip_unsupported=True)
+    try:
+        results = []
+        for file in require_uploads(form, 'files'):
+            if file.rejected:
+                results.append({"filename": file.filename, "error": "Not a HEIC or HEIF image"})
+                continue
+            try:
+                results.append({"filename": file.filename, **await inspect_upload(file)})
+            except Exception as e:
+                logger.error(f"Error inspecting batch file {file.filename}: {str(e)}")
+                results.append({"filename": file.filename, "error": f"Could not read HEIF metadata: {str(e)}"})
+    finally:
+        form.close()
     
+    return {"files": results}
+
+
+@api_router.post("/jobs", status_code=202)
+async def create_conversion_job(request: Request):
+    """
+    Submit HEIC files for asynchronous conversion and return the job id right away.
+    Accepts the same form fields as /convert-batch except combine_pdf. Files are converted
+    on the local worker pool at background priority; poll GET /api/jobs/{job_id} for
+    per-file progress and download the ZIP from GET /api/jobs/{job_id}/result once the
+    job is completed. Results are kept for JOB_RESULT_TTL seconds.
+    """
+    if job_store.active_jobs() >= job_store.max_active_jobs:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many conversion jobs in progress, please retry later",
+            headers={"Retry-After": str(conversion_executor.retry_after())}
+        )
+    
+    form = await spool_form(request, upload_limits, skip_unsupported=True)
     try:
-        # Process each file
+        files = require_uploads(form, 'files')
+        output_format = form.get('output_format', 'jpeg')
+        all_images = form.get_bool('all_images', False)
+        include_auxiliary = form.get_bool('include_auxiliary', False)
+        options = conversion_options_from_form(form)
+        
+        # Validate output format(s)
+        output_formats = parse_output_formats(output_format)
+        
+        uploads = []
         for file in files:
-            # Validate file extension
-            if not file.filename.lower().endswith(('.heic', '.heif')):
+            # Validate file extension and content (the ftyp brand was sniffed while spooling)
+            if not file.filename.lower().endswith(('.heic', '.heif')) or file.rejected:
                 logger.warning(f"Skipping non-HEIC file: {file.filename}")
                 continue
-            
-            # Create temporary file for input HEIC
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.heic') as temp_input:
-                temp_input_path = temp_input.name
-                temp_input_paths.append(temp_input_path)
-                
-                # Write uploaded file to temp location
-                content = await file.read()
-                temp_input.write(content)
-            
-            # Convert the file
-            file_content = convert_heic_to_format(temp_input_path, output_format)
-            
-            # Generate output filename
-            base_filename = Path(file.filename).stem
-            output_extension = 'jpg' if output_format == 'jpeg' else output_format
-            output_filename = f"{base_filename}.{output_extension}"
-            
-            converted_files.append((output_filename, file_content))
+            uploads.append(file)
         
-        if not converted_files:
+        if not uploads:
             raise HTTPException(
-                status_code=400,
+                status_code=415 if form.rejected_files() else 400,
                 detail="No valid HEIC files found"
             )
         
-        # Create ZIP file in memory
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for filename, content in converted_files:
-                zip_file.writestr(filename, content)
-        
-        zip_buffer.seek(0)
-        
-        # Clean up temporary input files
-        for temp_path in temp_input_paths:
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
-        
-        # Return the ZIP file
-        return StreamingResponse(
-            io.BytesIO(zip_buffer.getvalue()),
-            media_type="application/zip",
-            headers={
-                "Content-Disposition": f"attachment; filename=converted_files.zip"
-            }
-        )
+        job = job_store.create({
+            "output_formats": output_formats,
+            "options": options,
+            "all_images": all_images,
+            "include_auxiliary": include_auxiliary,
+        })
+        try:
+            # Move inputs out of the request's spools: the job outlives the request
+            for index, upload in enumerate(uploads, start=1):
+                input_path = job.directory / f"input-{index}"
+                await asyncio.to_thread(upload.save, input_path)
+                job_file = JobFile(index, upload.filename, input_path, upload.size)
+                job.files.append(job_file)
+                job.emit("queued", {"index": index, "filename": upload.filename, "size": upload.size})
+        except BaseException:
+            job_store.delete(job.id)
+            raise
+    finally:
+        form.close()
     
-    except HTTPException:
-        raise
+    job.task = asyncio.create_task(run_conversion_job(job))
+    return job.to_dict()
+
+
+async def run_conversion_job(job: ConversionJob):
+    """
+    Convert a job's files at background priority, up to BATCH_CONCURRENCY at a time,
+    storing each file's outputs in the job directory and publishing progress events.
+    """
+    conversion_priority.set("background")
+    settings = job.settings
+    job.status = "running"
+    
+    async def convert_file(job_file: JobFile):
+        started = None
+        
+        def record_start():
+            nonlocal started
+            started = time.monotonic()
+            job_file.started_at = utc_now()
+            job_file.queued_seconds = round(started - job.created_monotonic, 3)
+        
+        def mark_started():
+            """
+            The file's conversion has left every queue (admission, worker pool) and is running.
+            """
+            if started is not None:
+                return
+            record_start()
+            job_file.status = "converting"
+            job.emit("decoding", {
+                "index": job_file.index,
+                "filename": job_file.filename,
+                "queued_seconds": job_file.queued_seconds,
+            })
+        
+        conversion_started.set(mark_started)
+        try:
+            content = await asyncio.to_thread(job_file.input_path.read_bytes)
+            if work_queue is not None:
+                entries = await convert_on_work_queue(job_file.filename, content, settings, mark_started)
+            else:
+                entries = await convert_to_entries(
+                    job_file.filename, content, settings["output_formats"], settings["options"],
+                    settings["all_images"], settings["include_auxiliary"]
+                )
+            for output_filename, file_content in entries:
+                output_path = job.output_path(job_file, output_filename)
+                output_path.parent.mkdir(parents=True, exist_ok=True)
+                await asyncio.to_thread(output_path.write_bytes, file_content)
+        except Exception as e:
+            logger.error(f"Error converting job {job.id} file {job_file.filename}: {str(e)}")
+            job_file.status = "failed"
+            job_file.error = str(e)
+        else:
+            job_file.status = "done"
+            job_file.outputs = {name: len(data) for name, data in entries}
+        finally:
+            if started is None and job_file.status == "done":
+                # Served from the cache or by an identical conversion already in flight:
+                # nothing of this file's own ever ran on the pool, so only the timing is recorded
+                record_start()
+            finished = time.monotonic()
+            job_file.finished_at = utc_now()
+            if started is None:
+                # Failed before it could start (e.g. rejected by admission control)
+                job_file.queued_seconds = round(finished - job.created_monotonic, 3)
+                job_file.convert_seconds = 0.0
+            else:
+                job_file.convert_seconds = round(finished - started, 3)
+            job_file.input_path.unlink(missing_ok=True)
+        
+        if job_file.status == "done":
+            job.emit("done", {
+                "index": job_file.index,
+                "filename": job_file.filename,
+                "queued_seconds": job_file.queued_seconds,
+                "convert_seconds": job_file.convert_seconds,
+                "outputs": [
+                    {"name": name, "size": size, "url": f"/api/jobs/{job.id}/files/{job_file.index}/{name}"}
+                    for name, size in job_file.outputs.items()
+                ],
+            })
+        else:
+            job.emit("failed", {
+                "index": job_file.index,
+                "filename": job_file.filename,
+                "queued_seconds": job_file.queued_seconds,
+                "convert_seconds": job_file.convert_seconds,
+                "error": job_file.error,
+            })
+    
+    # Files finish in any order; a slow file doesn't hold back the ones queued after it
+    pending_files = iter(job.files)
+    
+    async def convert_files():
+        for job_file in pending_files:
+            await convert_file(job_file)
+    
+    try:
+        await asyncio.gather(*(convert_files() for _ in range(BATCH_CONCURRENCY)))
+        job_store.finish(job, "completed")
     except Exception as e:
-        # Clean up temporary files in case of error
-        for temp_path in temp_input_paths:
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
+        logger.error(f"Error running conversion job {job.id}: {str(e)}")
+        job_store.finish(job, "failed", str(e))
+
+
+async def convert_on_work_queue(
+    filename: str,
+    content: bytes,
+    settings: dict,
+    on_started: Optional[Callable[[], None]] = None
+) -> List[Tuple[str, bytes]]:
+    """
+    Convert one job file through the MongoDB work queue and return its ZIP entries.
+    The input and outputs travel through GridFS and are deleted once collected (or
+    purged when they expire, if this process goes away first). on_started is called
+    once a worker has claimed the task.
+    """
+    task_id = work_queue.new_task_id()
+    input_file_id = await work_queue.put_file(filename, content, task_id)
+    try:
+        await work_queue.enqueue("convert", {
+            "filename": filename,
+            "input_file_id": input_file_id,
+            "output_formats": settings["output_formats"],
+            "options": settings["options"].model_dump(),
+            "all_images": settings["all_images"],
+            "include_auxiliary": settings["include_auxiliary"],
+        }, priority=PRIORITY_CLASSES.index(conversion_priority.get()), task_id=task_id)
+        
+        try:
+            task = await work_queue.wait(task_id, on_running=on_started)
+        except asyncio.CancelledError:
+            # Job deleted or server shutting down: nobody will collect the result
+            await asyncio.shield(work_queue.delete(task_id))
+            raise
+        
+        if task["status"] == "dead":
+            # Dead-lettered tasks stay in the collection (until WORK_QUEUE_RETENTION) for inspection
+            raise RuntimeError(task["error"] or "Conversion failed")
         
-        logger.error(f"Error converting batch files: {str(e)}")
+        outputs = task["result"]["outputs"]
+        try:
+            return [(output["name"], await work_queue.get_file(output["file_id"])) for output in outputs]
+        finally:
+            for output in outputs:
+                await work_queue.delete_file(output["file_id"])
+            await work_queue.delete(task_id)
+    finally:
+        await work_queue.delete_file(input_file_id)
+
+
+async def handle_conversion_task(task: dict) -> dict:
+    """
+    Work queue handler: convert one GridFS input on this process's worker pool and
+    store every output in GridFS. If the attempt fails or is cancelled (lease lost,
+    shutdown) the outputs it already stored are deleted again.
+    """
+    conversion_priority.set(PRIORITY_CLASSES[task["priority"]])
+    payload = task["payload"]
+    content = await work_queue.get_file(payload["input_file_id"])
+    entries = await convert_to_entries(
+        payload["filename"], content, payload["output_formats"], ConversionOptions(**payload["options"]),
+        payload["all_images"], payload["include_auxiliary"]
+    )
+    
+    outputs = []
+    try:
+        for name, data in entries:
+            file_id = await work_queue.put_file(name, data, task["_id"])
+            outputs.append({"name": name, "file_id": file_id, "size": len(data)})
+    except BaseException:
+        async def discard_outputs():
+            for output in outputs:
+                await work_queue.delete_file(output["file_id"])
+        await asyncio.shield(discard_outputs())
+        raise
+    return {"outputs": outputs}
+
+
+def get_job_or_404(job_id: str) -> ConversionJob:
+    job = job_store.get(job_id)
+    if job is None:
         raise HTTPException(
-            status_code=500,
-            detail=f"Error converting files: {str(e)}"
+            status_code=404,
+            detail="Job not found or expired"
         )
+    return job
+
+
+@api_router.get("/jobs/{job_id}")
+async def get_conversion_job(job_id: str):
+    """
+    Report a job's status and per-file progress.
+    """
+    return get_job_or_404(job_id).to_dict()
+
+
+@api_router.get("/jobs/{job_id}/events")
+async def stream_conversion_job_events(job_id: str, request: Request):
+    """
+    Stream a job's progress as Server-Sent Events: per-file queued, decoding, done
+    (with output sizes and download URLs) and failed events with timings, then a final
+    "job" event. Events already published are replayed first, or only those after the
+    Last-Event-ID header when a client reconnects.
+    """
+    job = get_job_or_404(job_id)
+    last_event_id = request.headers.get('last-event-id', '')
+    after = int(last_event_id) if last_event_id.isdigit() else 0
+    
+    async def event_stream():
+        nonlocal after
+        while True:
+            events = await job.wait_for_events(after, SSE_KEEPALIVE_SECONDS)
+            if not events:
+                if job.finished:
+                    return
+                # Comment line so proxies don't close an idle connection
+                yield ": keep-alive\n\n"
+                continue
+            for event_id, event, data in events:
+                yield f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+            after = events[-1][0]
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
+@api_router.get("/jobs/{job_id}/files/{index}/{name}")
+async def get_conversion_job_file(job_id: str, index: int, name: str):
+    """
+    Download one output of a job file as soon as that file is done.
+    """
+    job = get_job_or_404(job_id)
+    if not 1 <= index <= len(job.files) or name not in job.files[index - 1].outputs:
+        raise HTTPException(
+            status_code=404,
+            detail="Output not found"
+        )
+    
+    return FileResponse(job.output_path(job.files[index - 1], name), filename=name)
+
+
+@api_router.get("/jobs/{job_id}/result")
+async def get_conversion_job_result(job_id: str):
+    """
+    Download every output of a completed job as one ZIP, streamed from the stored
+    outputs. Returns 409 while the job is still running.
+    """
+    job = get_job_or_404(job_id)
+    if job.status != "completed":
+        raise HTTPException(
+            status_code=409,
+            detail=f"Job is {job.status}" + (f": {job.error}" if job.error else "")
+        )
+    
+    async def stream_zip():
+        zip_writer = ZipStreamWriter()
+        errors = []
+        for job_file in job.files:
+            if job_file.error:
+                errors.append(f"{job_file.filename}: {job_file.error}")
+            for output_filename in job_file.outputs:
+                file_content = await asyncio.to_thread(job.output_path(job_file, output_filename).read_bytes)
+                yield zip_writer.add(output_filename, file_content)
+        
+        if errors:
+            yield zip_writer.add("conversion_errors.txt", "\n".join(errors).encode("utf-8"))
+        
+        yield zip_writer.close()
+    
+    return StreamingResponse(
+        stream_zip(),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f"attachment; filename=converted_files_{job.id}.zip"
+        }
+    )
 
 
 # Admin endpoints
@@ -331,6 +1451,26 @@ async def admin_login(credentials: HTTPBasicCredentials = Depends(security)):
     verify_admin(credentials)
     return {"message": "Login successful"}
 
+@api_router.get("/admin/conversion-stats")
+async def get_conversion_stats(authorized: bool = Depends(verify_admin)):
+    if work_queue is not None:
+        worker = getattr(app.state, 'queue_worker', None)
+        work_queue_stats = {
+            "tasks": await work_queue.stats(),
+            "worker": worker.stats() if worker else None
+        }
+    else:
+        work_queue_stats = None
+    
+    return {
+        "executor": conversion_executor.stats(),
+        "cache": conversion_cache.stats(),
+        "single_flight": conversion_flights.stats(),
+        "admission": decode_admission.stats(),
+        "jobs": job_store.stats(),
+        "work_queue": work_queue_stats
+    }
+
 @api_router.get("/admin/posts")
 async def get_all_posts(authorized: bool = Depends(verify_admin)):
     posts = await db.blog_posts.find({}, {"_id": 0}).to_list(1000)
@@ -565,4 +1705,60 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    client.close()
+
+@app.on_event("shutdown")
+async def shutdown_conversion_executor():
+    conversion_executor.shutdown()
+
+async def purge_conversion_cache():
+    # Expire cached outputs on schedule, even if they are never requested again
+    while True:
+        await asyncio.sleep(max(1, min(conversion_cache.ttl_seconds, 60)))
+        await conversion_cache.purge_expired()
+
+@app.on_event("startup")
+async def start_conversion_cache_purge():
+    if conversion_cache.enabled:
+        app.state.cache_purge_task = asyncio.create_task(purge_conversion_cache())
+
+@app.on_event("shutdown")
+async def shutdown_conversion_cache():
+    task = getattr(app.state, 'cache_purge_task', None)
+    if task:
+        task.cancel()
+    conversion_cache.close()
+
+async def purge_conversion_jobs():
+    # Delete finished jobs and their results once they expire
+    while True:
+        await asyncio.sleep(max(1, min(job_store.ttl_seconds, 60)))
+        job_store.purge_expired()
+        await asyncio.to_thread(job_store.purge_stale_workers)
+
+@app.on_event("startup")
+async def start_conversion_job_purge():
+    app.state.job_purge_task = asyncio.create_task(purge_conversion_jobs())
+
+@app.on_event("shutdown")
+async def shutdown_conversion_jobs():
+    task = getattr(app.state, 'job_purge_task', None)
+    if task:
+        task.cancel()
+    job_store.close()
+
+@app.on_event("startup")
+async def start_queue_worker():
+    if work_queue is None:
+        return
+    await work_queue.ensure_indexes()
+    if WORK_QUEUE_WORKERS > 0:
+        app.state.queue_worker = QueueWorker(work_queue, handle_conversion_task, WORK_QUEUE_WORKERS)
+        app.state.queue_worker_task = asyncio.create_task(app.state.queue_worker.run_forever())
+
+@app.on_event("shutdown")
+async def shutdown_queue_worker():
+    task = getattr(app.state, 'queue_worker_task', None)
+    if task:
+        task.cancel()
+        app.state.queue_worker.stop()
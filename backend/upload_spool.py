@@ -0,0 +1,346 @@
+from fastapi import HTTPException, Request
+from pydantic import BaseModel
+from tempfile import SpooledTemporaryFile
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Union
+import asyncio
+import shutil
+import os
+
+from heif_header import SNIFF_BYTES, is_heif_header
+
+try:
+    import python_multipart as multipart
+    from python_multipart.exceptions import MultipartParseError
+    from python_multipart.multipart import parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    import multipart
+    from multipart.exceptions import MultipartParseError
+    from multipart.multipart import parse_options_header
+
+# Plain form fields are small option values; anything bigger is not a real client
+MAX_FIELD_BYTES = 64 * 1024
+
+
+class UploadLimits(BaseModel):
+    """
+    Byte limits for multipart uploads. Uploads are spooled in memory up to
+    spool_memory_bytes per file and to a temporary file above that.
+    """
+    max_file_bytes: int = 50 * 1024 * 1024
+    max_request_bytes: int = 500 * 1024 * 1024
+    max_files: int = 1000
+    spool_memory_bytes: int = 1024 * 1024
+
+    @classmethod
+    def from_env(cls) -> "UploadLimits":
+        """
+        Build limits from MAX_UPLOAD_FILE_BYTES, MAX_UPLOAD_REQUEST_BYTES,
+        MAX_UPLOAD_FILES and UPLOAD_SPOOL_MEMORY_BYTES environment variables.
+        """
+        defaults = cls()
+        return cls(
+            max_file_bytes=int(os.environ.get('MAX_UPLOAD_FILE_BYTES', defaults.max_file_bytes)),
+            max_request_bytes=int(os.environ.get('MAX_UPLOAD_REQUEST_BYTES', defaults.max_request_bytes)),
+            max_files=int(os.environ.get('MAX_UPLOAD_FILES', defaults.max_files)),
+            spool_memory_bytes=int(os.environ.get('UPLOAD_SPOOL_MEMORY_BYTES', defaults.spool_memory_bytes))
+        )
+
+
+class FormField(NamedTuple):
+    name: str
+    value: str
+
+
+class SpooledUpload:
+    """
+    One uploaded file, held in memory below the spool threshold and on disk above it.
+    """
+
+    def __init__(self, field_name: str, filename: str, content_type: str, spool_memory_bytes: int):
+        self.field_name = field_name
+        self.filename = filename
+        self.content_type = content_type
+        self.size = 0
+        self.file = SpooledTemporaryFile(max_size=spool_memory_bytes)
+        # Set when the content isn't HEIF; the spool is closed and further data dropped
+        self.rejected = False
+        self._header = b""
+        self._sniffed = False
+
+    async def write(self, data: bytes):
+        self.size += len(data)
+        if getattr(self.file, '_rolled', False):
+            # Spilled to disk: don't block the event loop on file I/O
+            await asyncio.to_thread(self.file.write, data)
+        else:
+            self.file.write(data)
+
+    def sniff(self, data: bytes, final: bool = False) -> bool:
+        """
+        Feed the first bytes of the file and check its ftyp brand once SNIFF_BYTES
+        (or the whole file, if final) have arrived. Returns False for non-HEIF content.
+        """
+        if self._sniffed:
+            return True
+        self._header += data[:SNIFF_BYTES - len(self._header)]
+        if len(self._header) < SNIFF_BYTES and not final:
+            return True
+        self._sniffed = True
+        return is_heif_header(self._header)
+
+    def reject(self):
+        self.rejected = True
+        self.file.close()
+
+    def read(self) -> bytes:
+        self.file.seek(0)
+        return self.file.read()
+
+    def save(self, path):
+        """
+        Copy the spooled content to path (blocking; run it in a thread for large files).
+        """
+        self.file.seek(0)
+        with open(path, 'wb') as target:
+            shutil.copyfileobj(self.file, target)
+
+    def close(self):
+        self.file.close()
+
+
+class SpooledForm:
+    """
+    Parsed multipart form: plain fields by name (last value wins) and uploaded files in order.
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, str] = {}
+        self.files: List[SpooledUpload] = []
+
+    def get(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return self.fields.get(name, default)
+
+    def get_int(self, name: str, default: Optional[int] = None) -> Optional[int]:
+        return self._parse(name, default, int, "an integer")
+
+    def get_float(self, name: str, default: Optional[float] = None) -> Optional[float]:
+        return self._parse(name, default, float, "a number")
+
+    def get_bool(self, name: str, default: Optional[bool] = None) -> Optional[bool]:
+        return self._parse(name, default, parse_bool, "a boolean")
+
+    def files_for(self, field_name: str) -> List[SpooledUpload]:
+        return [upload for upload in self.files if upload.field_name == field_name]
+
+    def rejected_files(self) -> List[SpooledUpload]:
+        return [upload for upload in self.files if upload.rejected]
+
+    def close(self):
+        for upload in self.files:
+            upload.close()
+
+    def _parse(self, name, default, parse, description):
+        value = self.fields.get(name)
+        if value is None or value == "":
+            return default
+        try:
+            return parse(value)
+        except ValueError:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Form field '{name}' must be {description}"
+            )
+
+
+def parse_bool(value: str) -> bool:
+    """
+    Parse a form boolean the way FastAPI does (true/false, 1/0, on/off, yes/no).
+    """
+    lowered = value.strip().lower()
+    if lowered in ("true", "1", "on", "yes"):
+        return True
+    if lowered in ("false", "0", "off", "no"):
+        return False
+    raise ValueError(value)
+
+
+def check_multipart_request(request: Request, limits: UploadLimits) -> bytes:
+    """
+    Validate a multipart/form-data request from its headers alone and return the boundary.
+    Raises 422 if the body isn't multipart and 413 if its declared length is over the limit.
+    """
+    content_type, params = parse_options_header(request.headers.get('content-type', ''))
+    if content_type != b'multipart/form-data' or b'boundary' not in params:
+        # Same status FastAPI gives a File(...) parameter that is missing from the body
+        raise HTTPException(
+            status_code=422,
+            detail="Request body must be multipart/form-data"
+        )
+
+    content_length = request.headers.get('content-length')
+    if content_length and content_length.isdigit() and int(content_length) > limits.max_request_bytes:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Request exceeds the maximum upload size of {limits.max_request_bytes} bytes"
+        )
+    return params[b'boundary']
+
+
+async def iter_multipart(
+    request: Request,
+    limits: UploadLimits,
+    skip_unsupported: bool = False
+) -> AsyncIterator[Union[FormField, SpooledUpload]]:
+    """
+    Read a multipart/form-data body incrementally and yield each part as soon as it
+    has been fully received: FormField for plain fields, SpooledUpload for files.
+    Limits are enforced while the body streams in, so an oversized upload is rejected
+    with 413 without reading the rest of it. The caller owns (and must close) every
+    yielded SpooledUpload; a partially received file is closed here on error.
+    Files are sniffed for a HEIF ftyp box as their first bytes arrive. Non-HEIF files
+    fail the request with 415, or with skip_unsupported are yielded with rejected=True
+    and their remaining data is discarded instead of spooled.
+    """
+    boundary = check_multipart_request(request, limits)
+
+    # The parser callbacks are synchronous; queue their events and handle them after each chunk
+    events = []
+    header = {"name": b"", "value": b""}
+    headers = {}
+
+    def on_header_field(data, start, end):
+        header["name"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        header["value"] += data[start:end]
+
+    def on_header_end():
+        headers[header["name"].lower()] = header["value"]
+        header["name"] = header["value"] = b""
+
+    def on_headers_finished():
+        events.append(("headers", dict(headers)))
+        headers.clear()
+
+    callbacks = {
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": lambda data, start, end: events.append(("data", data[start:end])),
+        "on_part_end": lambda: events.append(("end", None)),
+    }
+    parser = multipart.MultipartParser(boundary, callbacks)
+
+    received = 0
+    file_count = 0
+    part: Optional[SpooledUpload] = None
+    field_name = None
+    field_data = b""
+
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > limits.max_request_bytes:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Request exceeds the maximum upload size of {limits.max_request_bytes} bytes"
+                )
+
+            write_multipart(parser, chunk)
+
+            for event, payload in events:
+                if event == "headers":
+                    _, disposition = parse_options_header(payload.get(b'content-disposition', b''))
+                    field_name = disposition.get(b'name', b'').decode('utf-8', 'replace')
+                    field_data = b""
+                    if b'filename' in disposition:
+                        file_count += 1
+                        if file_count > limits.max_files:
+                            raise HTTPException(
+                                status_code=413,
+                                detail=f"Too many files. Maximum number of files is {limits.max_files}"
+                            )
+                        part = SpooledUpload(
+                            field_name,
+                            disposition[b'filename'].decode('utf-8', 'replace'),
+                            payload.get(b'content-type', b'').decode('latin-1'),
+                            limits.spool_memory_bytes
+                        )
+
+                elif event == "data":
+                    if part is None:
+                        field_data += payload
+                        if len(field_data) > MAX_FIELD_BYTES:
+                            raise HTTPException(
+                                status_code=413,
+                                detail=f"Form field '{field_name}' is too large"
+                            )
+                    elif not part.rejected:
+                        if not part.sniff(payload):
+                            reject_unsupported(part, skip_unsupported)
+                            continue
+                        if part.size + len(payload) > limits.max_file_bytes:
+                            raise HTTPException(
+                                status_code=413,
+                                detail=f"File {part.filename} exceeds the maximum file size of {limits.max_file_bytes} bytes"
+                            )
+                        await part.write(payload)
+
+                elif event == "end":
+                    if part is None:
+                        yield FormField(field_name, field_data.decode('utf-8', 'replace'))
+                    else:
+                        if not part.rejected and not part.sniff(b"", final=True):
+                            reject_unsupported(part, skip_unsupported)
+                        completed, part = part, None
+                        yield completed
+            events.clear()
+
+        write_multipart(parser, None)
+    finally:
+        if part is not None:
+            part.close()
+
+
+def write_multipart(parser, chunk: Optional[bytes]):
+    """
+    Feed a chunk to the parser (None finalizes it), turning a malformed body into a 400
+    like Starlette's own form parser does.
+    """
+    try:
+        if chunk is None:
+            parser.finalize()
+        else:
+            parser.write(chunk)
+    except MultipartParseError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"There was an error parsing the body: {str(e)}"
+        )
+
+
+def reject_unsupported(upload: SpooledUpload, skip_unsupported: bool):
+    upload.reject()
+    if not skip_unsupported:
+        raise HTTPException(
+            status_code=415,
+            detail=f"File {upload.filename} is not a HEIC or HEIF image"
+        )
+
+
+async def spool_form(request: Request, limits: UploadLimits, skip_unsupported: bool = False) -> SpooledForm:
+    """
+    Read the whole multipart body into a SpooledForm, enforcing the upload limits.
+    """
+    form = SpooledForm()
+    try:
+        async for item in iter_multipart(request, limits, skip_unsupported):
+            if isinstance(item, SpooledUpload):
+                form.files.append(item)
+            else:
+                form.fields[item.name] = item.value
+    except BaseException:
+        form.close()
+        raise
+    return form
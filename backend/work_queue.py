@@ -0,0 +1,368 @@
+from datetime import datetime, timedelta, timezone
+from motor.motor_asyncio import AsyncIOMotorDatabase, AsyncIOMotorGridFSBucket
+from pymongo import ASCENDING, ReturnDocument
+from typing import Awaitable, Callable, Optional
+import asyncio
+import logging
+import socket
+import time
+import uuid
+import os
+
+logger = logging.getLogger(__name__)
+
+# Task lifecycle:
+#   queued  - waiting to be claimed (again, after a failed attempt, once available_at has passed)
+#   running - claimed by a worker holding an unexpired lease
+#   done    - completed; result holds the handler's return value
+#   dead    - failed max_attempts times (dead letter); error holds the last failure
+TASK_STATUSES = ["queued", "running", "done", "dead"]
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class WorkQueue:
+    """
+    Conversion task queue shared by every replica through MongoDB.
+
+    Workers claim tasks atomically with a lease (find_one_and_update), renew it with
+    heartbeats while they work and release it on completion. A task whose lease expires
+    (worker crashed or hung) is put back in the queue; after max_attempts failed or
+    abandoned attempts it is moved to the dead-letter state. Lower priority values are
+    claimed first. Task inputs and outputs live in GridFS so any replica can reach them.
+    Each GridFS file records its task and an expiry in its metadata; files whose owner
+    never collected them (submitter restarted, failed or abandoned attempts) are removed
+    by purge_expired_files once they expire.
+    """
+
+    def __init__(
+        self,
+        db: AsyncIOMotorDatabase,
+        collection: str = "conversion_tasks",
+        lease_seconds: float = 60,
+        max_attempts: int = 3,
+        retry_delay_seconds: float = 5,
+        retention_seconds: float = 24 * 3600
+    ):
+        self.tasks = db[collection]
+        self.files = AsyncIOMotorGridFSBucket(db, bucket_name=collection)
+        self.file_records = db[f"{collection}.files"]
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay_seconds = retry_delay_seconds
+        self.retention_seconds = retention_seconds
+
+    @classmethod
+    def from_env(cls, db: AsyncIOMotorDatabase) -> "WorkQueue":
+        """
+        Build the queue from WORK_QUEUE_LEASE_SECONDS, WORK_QUEUE_MAX_ATTEMPTS,
+        WORK_QUEUE_RETRY_DELAY and WORK_QUEUE_RETENTION environment variables.
+        """
+        return cls(
+            db,
+            lease_seconds=float(os.environ.get('WORK_QUEUE_LEASE_SECONDS', 60)),
+            max_attempts=int(os.environ.get('WORK_QUEUE_MAX_ATTEMPTS', 3)),
+            retry_delay_seconds=float(os.environ.get('WORK_QUEUE_RETRY_DELAY', 5)),
+            retention_seconds=float(os.environ.get('WORK_QUEUE_RETENTION', 24 * 3600))
+        )
+
+    async def ensure_indexes(self):
+        await self.tasks.create_index([("status", ASCENDING), ("priority", ASCENDING), ("available_at", ASCENDING)])
+        await self.tasks.create_index([("status", ASCENDING), ("lease_expires_at", ASCENDING)])
+        # Finished tasks are removed by MongoDB once expires_at has passed
+        await self.tasks.create_index("expires_at", expireAfterSeconds=0)
+        # Not a TTL index: that would drop the files documents but leave their chunks behind
+        await self.file_records.create_index("metadata.expires_at")
+
+    @staticmethod
+    def new_task_id() -> str:
+        return uuid.uuid4().hex
+
+    async def enqueue(self, kind: str, payload: dict, priority: int = 0, task_id: Optional[str] = None) -> str:
+        """
+        Add a task. Pass task_id (from new_task_id) to store its input files before enqueueing.
+        """
+        task_id = task_id or self.new_task_id()
+        now = utc_now()
+        await self.tasks.insert_one({
+            "_id": task_id,
+            "kind": kind,
+            "payload": payload,
+            "priority": priority,
+            "status": "queued",
+            "attempts": 0,
+            "max_attempts": self.max_attempts,
+            "available_at": now,
+            "created_at": now,
+            "lease_owner": None,
+            "lease_expires_at": None,
+            "error": None,
+            "result": None,
+            "expires_at": None,
+        })
+        return task_id
+
+    async def claim(self, worker_id: str) -> Optional[dict]:
+        """
+        Atomically take the most urgent available task and lease it to worker_id.
+        """
+        await self.recover_expired_leases()
+        now = utc_now()
+        return await self.tasks.find_one_and_update(
+            {"status": "queued", "available_at": {"$lte": now}},
+            {
+                "$set": {
+                    "status": "running",
+                    "lease_owner": worker_id,
+                    "lease_expires_at": now + timedelta(seconds=self.lease_seconds),
+                    "started_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("priority", ASCENDING), ("available_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def heartbeat(self, task_id: str, worker_id: str) -> bool:
+        """
+        Extend the lease. Returns False if the worker no longer holds it.
+        """
+        result = await self.tasks.update_one(
+            {"_id": task_id, "status": "running", "lease_owner": worker_id},
+            {"$set": {"lease_expires_at": utc_now() + timedelta(seconds=self.lease_seconds)}}
+        )
+        return result.matched_count == 1
+
+    async def complete(self, task_id: str, worker_id: str, result: dict) -> bool:
+        now = utc_now()
+        update = await self.tasks.update_one(
+            {"_id": task_id, "status": "running", "lease_owner": worker_id},
+            {"$set": {
+                "status": "done",
+                "result": result,
+                "completed_at": now,
+                "lease_owner": None,
+                "lease_expires_at": None,
+                "expires_at": now + timedelta(seconds=self.retention_seconds),
+            }}
+        )
+        return update.matched_count == 1
+
+    async def fail(self, task: dict, worker_id: str, error: str) -> bool:
+        """
+        Record a failed attempt: retry with exponential backoff, or dead-letter the task
+        once it has used up max_attempts.
+        """
+        now = utc_now()
+        if task["attempts"] >= task["max_attempts"]:
+            update = {
+                "status": "dead",
+                "completed_at": now,
+                "expires_at": now + timedelta(seconds=self.retention_seconds),
+            }
+        else:
+            update = {
+                "status": "queued",
+                "available_at": now + timedelta(seconds=self.retry_delay_seconds * 2 ** (task["attempts"] - 1)),
+            }
+        result = await self.tasks.update_one(
+            {"_id": task["_id"], "status": "running", "lease_owner": worker_id},
+            {"$set": {**update, "error": error, "lease_owner": None, "lease_expires_at": None}}
+        )
+        return result.matched_count == 1
+
+    async def recover_expired_leases(self):
+        """
+        Requeue tasks whose worker stopped heartbeating, or dead-letter them if they
+        have no attempts left.
+        """
+        now = utc_now()
+        expired = {"status": "running", "lease_expires_at": {"$lte": now}}
+        released = {"lease_owner": None, "lease_expires_at": None, "error": "Lease expired"}
+        await self.tasks.update_many(
+            {**expired, "$expr": {"$gte": ["$attempts", "$max_attempts"]}},
+            {"$set": {
+                **released,
+                "status": "dead",
+                "completed_at": now,
+                "expires_at": now + timedelta(seconds=self.retention_seconds),
+            }}
+        )
+        await self.tasks.update_many(
+            expired,
+            {"$set": {**released, "status": "queued", "available_at": now}}
+        )
+
+    async def get(self, task_id: str) -> Optional[dict]:
+        return await self.tasks.find_one({"_id": task_id})
+
+    async def wait(
+        self,
+        task_id: str,
+        poll_seconds: float = 0.5,
+        on_running: Optional[Callable[[], None]] = None
+    ) -> dict:
+        """
+        Poll until the task is done or dead and return it. on_running is called once,
+        the first time a worker is seen holding the task.
+        """
+        while True:
+            task = await self.get(task_id)
+            if task is None:
+                raise LookupError(f"Task {task_id} no longer exists")
+            if on_running is not None and task["status"] == "running":
+                on_running()
+                on_running = None
+            if task["status"] in ("done", "dead"):
+                return task
+            await asyncio.sleep(poll_seconds)
+
+    async def delete(self, task_id: str):
+        await self.tasks.delete_one({"_id": task_id})
+
+    async def put_file(self, filename: str, data: bytes, task_id: str, expires_in: Optional[float] = None):
+        """
+        Store a task input or output. It is purged expires_in seconds from now
+        (default: retention_seconds) unless its owner deletes it first.
+        """
+        expires_in = self.retention_seconds if expires_in is None else expires_in
+        return await self.files.upload_from_stream(filename, data, metadata={
+            "task_id": task_id,
+            "expires_at": utc_now() + timedelta(seconds=expires_in),
+        })
+
+    async def get_file(self, file_id) -> bytes:
+        stream = await self.files.open_download_stream(file_id)
+        return await stream.read()
+
+    async def delete_file(self, file_id):
+        try:
+            await self.files.delete(file_id)
+        except Exception as e:
+            logger.warning(f"Could not delete work queue file {file_id}: {str(e)}")
+
+    async def purge_expired_files(self) -> int:
+        """
+        Delete GridFS files past their expiry. Returns how many were deleted.
+        """
+        expired = self.file_records.find({"metadata.expires_at": {"$lte": utc_now()}}, {"_id": 1})
+        deleted = 0
+        async for record in expired:
+            await self.delete_file(record["_id"])
+            deleted += 1
+        return deleted
+
+    async def stats(self) -> dict:
+        counts = {status: 0 for status in TASK_STATUSES}
+        async for row in self.tasks.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+            counts[row["_id"]] = row["count"]
+        return counts
+
+
+class QueueWorker:
+    """
+    Pulls tasks from a WorkQueue and runs up to `concurrency` of them at a time.
+
+    handler(task) returns the task result (a dict stored on the task document) or raises
+    to fail the attempt. While it runs the lease is renewed every third of the lease
+    period; if the lease is lost, the handler is cancelled since another worker now owns
+    the task. Expired GridFS files are purged every lease period.
+    """
+
+    def __init__(
+        self,
+        queue: WorkQueue,
+        handler: Callable[[dict], Awaitable[dict]],
+        concurrency: int = 1,
+        poll_seconds: float = 1
+    ):
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = concurrency
+        self.poll_seconds = poll_seconds
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._slots = asyncio.Semaphore(concurrency)
+        self._running = set()
+        self._next_file_purge = 0.0
+        self.completed = 0
+        self.failed = 0
+
+    async def run_forever(self):
+        while True:
+            await self._slots.acquire()
+            await self._purge_files_if_due()
+            try:
+                task = await self.queue.claim(self.worker_id)
+            except Exception as e:
+                logger.error(f"Error claiming work queue task: {str(e)}")
+                task = None
+
+            if task is None:
+                self._slots.release()
+                await asyncio.sleep(self.poll_seconds)
+                continue
+
+            running = asyncio.create_task(self._run_task(task))
+            self._running.add(running)
+            running.add_done_callback(self._running.discard)
+
+    async def _purge_files_if_due(self):
+        if time.monotonic() < self._next_file_purge:
+            return
+        self._next_file_purge = time.monotonic() + self.queue.lease_seconds
+        try:
+            deleted = await self.queue.purge_expired_files()
+            if deleted:
+                logger.info(f"Purged {deleted} expired work queue files")
+        except Exception as e:
+            logger.error(f"Error purging work queue files: {str(e)}")
+
+    async def _run_task(self, task: dict):
+        try:
+            work = asyncio.ensure_future(self.handler(task))
+            while True:
+                done, _ = await asyncio.wait({work}, timeout=self.queue.lease_seconds / 3)
+                if done:
+                    break
+                if not await self.queue.heartbeat(task["_id"], self.worker_id):
+                    logger.warning(f"Lost lease on work queue task {task['_id']}, abandoning it")
+                    work.cancel()
+                    return
+
+            try:
+                result = work.result()
+            except Exception as e:
+                logger.error(f"Work queue task {task['_id']} failed: {str(e)}")
+                self.failed += 1
+                await self.queue.fail(task, self.worker_id, str(e))
+                return
+
+            self.completed += 1
+            await self.queue.complete(task["_id"], self.worker_id, result)
+        except asyncio.CancelledError:
+            # Shutting down: the lease expires and another worker retries the task
+            if not work.done():
+                work.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"Error updating work queue task {task['_id']}: {str(e)}")
+        finally:
+            self._slots.release()
+
+    def stop(self):
+        """
+        Cancel running tasks. Their leases expire and other workers retry them.
+        """
+        for running in list(self._running):
+            running.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "worker_id": self.worker_id,
+            "concurrency": self.concurrency,
+            "running": len(self._running),
+            "completed": self.completed,
+            "failed": self.failed,
+        }
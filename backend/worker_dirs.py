@@ -0,0 +1,77 @@
+from pathlib import Path
+import logging
+import os
+import shutil
+import socket
+import time
+
+logger = logging.getLogger(__name__)
+
+WORKER_DIR_PREFIX = "worker-"
+
+
+def worker_dir(base_dir: Path) -> Path:
+    """
+    This process's subdirectory of base_dir, so uvicorn workers sharing base_dir don't collide.
+    The host name is part of the name because base_dir may be shared between hosts.
+    """
+    return base_dir / f"{WORKER_DIR_PREFIX}{socket.gethostname()}-{os.getpid()}"
+
+
+def process_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, but belongs to another user
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def last_modified(path: Path) -> float:
+    """
+    Newest mtime of path and everything below it (deleting a file updates its directory).
+    """
+    newest = path.stat().st_mtime
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            try:
+                newest = max(newest, os.stat(os.path.join(root, name)).st_mtime)
+            except OSError:
+                pass
+    return newest
+
+
+def purge_stale_worker_dirs(base_dir: Path, max_age_seconds: float):
+    """
+    Remove the directories other processes left under base_dir. A directory of this host
+    is stale only when its owner pid is no longer running (a crashed or OOM-killed worker);
+    a live worker's directory is never touched, however long it has been idle. Directories
+    of other hosts sharing base_dir can't be checked by pid, so they are stale once nothing
+    in them changed for max_age_seconds.
+    """
+    own_dir = worker_dir(base_dir)
+    hostname = socket.gethostname()
+    now = time.time()
+    try:
+        candidates = [path for path in base_dir.iterdir() if path.name.startswith(WORKER_DIR_PREFIX)]
+    except OSError:
+        return
+
+    for path in candidates:
+        if path == own_dir or not path.is_dir():
+            continue
+        host, _, pid = path.name[len(WORKER_DIR_PREFIX):].rpartition("-")
+        try:
+            if host == hostname and pid.isdigit():
+                stale = not process_running(int(pid))
+            else:
+                stale = now - last_modified(path) > max_age_seconds
+        except OSError:
+            continue
+        if stale:
+            logger.info(f"Removing stale worker directory {path}")
+            shutil.rmtree(path, ignore_errors=True)
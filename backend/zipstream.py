@@ -0,0 +1,72 @@
+from pathlib import Path
+import time
+import zipfile
+
+# Outputs that are already compressed (JPEG/WebP/AVIF entropy coding, PNG and PDF Flate
+# streams); deflating them again costs CPU on the event loop and doesn't shrink them
+COMPRESSED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".avif", ".pdf", ".heic", ".heif", ".zip"}
+
+
+class _ChunkSink:
+    """
+    Write-only file object that collects bytes written by ZipFile until drained.
+    It deliberately has no seek(), so ZipFile writes data descriptors after each
+    entry instead of seeking back to patch local headers.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStreamWriter:
+    """
+    Incremental ZIP writer for streaming responses.
+
+    Each add() returns the bytes for that entry as soon as it is written and
+    close() returns the central directory, so only the entry being written is
+    held in memory. ZIP64 records are emitted automatically for large entries
+    and archives. Entries in an already compressed format are stored as-is and
+    only the others use `compression`.
+    """
+
+    def __init__(self, compression: int = zipfile.ZIP_DEFLATED):
+        self._sink = _ChunkSink()
+        self._zip = zipfile.ZipFile(self._sink, 'w', compression, allowZip64=True)
+        self.compression = compression
+
+    def add(self, filename: str, data: bytes) -> bytes:
+        """
+        Write one entry and return the ZIP bytes produced for it.
+        """
+        info = zipfile.ZipInfo(filename, date_time=time.localtime()[:6])
+        if Path(filename).suffix.lower() in COMPRESSED_EXTENSIONS:
+            info.compress_type = zipfile.ZIP_STORED
+        else:
+            info.compress_type = self.compression
+        info.external_attr = 0o644 << 16
+        self._zip.writestr(info, data)
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        """
+        Finish the archive and return the central directory bytes.
+        """
+        self._zip.close()
+        return self._sink.drain()
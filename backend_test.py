@@ -43,8 +43,9 @@ class HEICConverterTester:
     def create_test_heic_file(self):
         """Create a minimal test file that mimics HEIC structure"""
         # Create a simple test file with .heic extension
-        # Note: This won't be a real HEIC file, but will test file handling
-        test_content = b"HEIC_TEST_FILE_CONTENT"
+        # Note: This won't be a real HEIC file, but will test file handling.
+        # It starts with a HEIF ftyp box so it passes the upload's content sniffing.
+        test_content = b"\x00\x00\x00\x18ftypheic\x00\x00\x00\x00mif1heic" + b"HEIC_TEST_FILE_CONTENT"
         temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.heic')
         temp_file.write(test_content)
         temp_file.close()
@@ -63,8 +64,9 @@ class HEICConverterTester:
                 data = {'output_format': 'jpeg'}
                 response = requests.post(f"{self.api_url}/convert", files=files, data=data, timeout=30)
             
-            # Should return 400 for invalid file type
-            success = response.status_code == 400
+            # Should return 415: the content is sniffed (and rejected) while it uploads,
+            # before the extension is checked
+            success = response.status_code == 415
             details = f"Status: {response.status_code}, Response: {response.text[:200]}"
             self.log_test("File Validation - Invalid Extension", success, details)
             
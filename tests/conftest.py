@@ -0,0 +1,41 @@
+import io
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# Backend modules import each other as top-level modules (uvicorn runs from backend/)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+
+@pytest.fixture(scope="session")
+def heic_bytes() -> bytes:
+    import pillow_heif
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    pillow_heif.from_pillow(Image.new("RGB", (64, 48), (30, 120, 200))).save(buffer, quality=80)
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope="session")
+def server(tmp_path_factory):
+    """
+    The backend app module. Mongo is only contacted by the endpoints that store records,
+    so a client pointed at an unused port is enough to import it.
+    """
+    os.environ.setdefault("MONGO_URL", "mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=100")
+    os.environ.setdefault("DB_NAME", "heic_converter_test")
+    os.environ["JOBS_DIR"] = str(tmp_path_factory.mktemp("jobs"))
+    import server
+    return server
+
+
+@pytest.fixture(scope="session")
+def client(server):
+    from fastapi.testclient import TestClient
+
+    # One client for the whole session: shutdown closes the shared conversion pool
+    with TestClient(server.app) as client:
+        yield client
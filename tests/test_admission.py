@@ -0,0 +1,189 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from admission import UNKNOWN_IMAGE_BYTES, DecodeAdmission
+from heif_header import HeifImageInfo
+
+# 100 x 100 at 8 bits: 70,000 bytes of estimated decode memory
+SMALL = HeifImageInfo(100, 100, 8)
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def hold(admission: DecodeAdmission, info, entered: asyncio.Event, release: asyncio.Event):
+    async with admission.admit_image(info):
+        entered.set()
+        await release.wait()
+
+
+def test_admits_within_budget_and_releases():
+    async def main():
+        admission = DecodeAdmission(max_memory_bytes=SMALL.decoded_bytes * 2)
+        async with admission.admit_image(SMALL):
+            async with admission.admit_image(SMALL):
+                assert admission.reserved_bytes == SMALL.decoded_bytes * 2
+        assert admission.reserved_bytes == 0
+        assert admission.stats()["admitted"] == 2
+        assert admission.stats()["queued"] == 0
+
+    run(main())
+
+
+def test_waiter_is_granted_when_memory_is_released():
+    async def main():
+        admission = DecodeAdmission(max_memory_bytes=SMALL.decoded_bytes, max_wait_seconds=5)
+        entered, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(hold(admission, SMALL, entered, release))
+        await entered.wait()
+
+        second_entered = asyncio.Event()
+        second = asyncio.create_task(hold(admission, SMALL, second_entered, asyncio.Event()))
+        await asyncio.sleep(0.01)
+        assert not second_entered.is_set()
+        assert admission.stats()["waiting"] == 1
+
+        release.set()
+        await holder
+        await asyncio.wait_for(second_entered.wait(), 1)
+        assert admission.reserved_bytes == SMALL.decoded_bytes
+        second.cancel()
+
+    run(main())
+
+
+def test_waiters_are_granted_in_fifo_order():
+    async def main():
+        admission = DecodeAdmission(max_memory_bytes=SMALL.decoded_bytes * 2, max_wait_seconds=5)
+        entered, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(hold(admission, HeifImageInfo(100, 200, 8), entered, release))
+        await entered.wait()
+
+        order = []
+
+        async def waiter(name, info):
+            async with admission.admit_image(info):
+                order.append(name)
+
+        # A large request at the head of the queue isn't overtaken by a small one behind it
+        tasks = [
+            asyncio.create_task(waiter("large", HeifImageInfo(100, 200, 8))),
+            asyncio.create_task(waiter("small", SMALL)),
+        ]
+        await asyncio.sleep(0.01)
+        assert order == []
+
+        release.set()
+        await holder
+        await asyncio.gather(*tasks)
+        assert order == ["large", "small"]
+
+    run(main())
+
+
+def test_wait_timeout_is_rejected_with_503_and_unblocks_the_queue():
+    async def main():
+        admission = DecodeAdmission(
+            max_memory_bytes=SMALL.decoded_bytes * 2, max_wait_seconds=0.1, retry_after_seconds=7
+        )
+        entered, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(hold(admission, SMALL, entered, release))
+        await entered.wait()
+
+        small_admitted = asyncio.Event()
+
+        async def too_large():
+            async with admission.admit_image(HeifImageInfo(100, 200, 8)):
+                pass
+
+        async def small():
+            async with admission.admit_image(SMALL):
+                small_admitted.set()
+
+        large_task = asyncio.create_task(too_large())
+        # Queue the small request well before the large one times out
+        await asyncio.sleep(0.02)
+        small_task = asyncio.create_task(small())
+
+        with pytest.raises(HTTPException) as error:
+            await large_task
+        assert error.value.status_code == 503
+        assert error.value.headers == {"Retry-After": "7"}
+
+        # The small request was queued behind the large one and fits once it gives up
+        await asyncio.wait_for(small_admitted.wait(), 1)
+        await small_task
+        assert admission.stats()["rejected_busy"] == 1
+        assert admission.stats()["waiting"] == 0
+
+        release.set()
+        await holder
+        assert admission.reserved_bytes == 0
+
+    run(main())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def main():
+        admission = DecodeAdmission(max_memory_bytes=SMALL.decoded_bytes, max_wait_seconds=5)
+        entered, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(hold(admission, SMALL, entered, release))
+        await entered.wait()
+
+        waiter = asyncio.create_task(hold(admission, SMALL, asyncio.Event(), asyncio.Event()))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert admission.stats()["waiting"] == 0
+
+        release.set()
+        await holder
+        assert admission.reserved_bytes == 0
+
+    run(main())
+
+
+def test_image_larger_than_the_budget_runs_alone():
+    async def main():
+        admission = DecodeAdmission(max_memory_bytes=SMALL.decoded_bytes, max_pixels=0)
+        async with admission.admit_image(HeifImageInfo(1000, 1000, 8)):
+            assert admission.reserved_bytes == SMALL.decoded_bytes
+
+    run(main())
+
+
+def test_unknown_header_uses_the_default_estimate():
+    async def main():
+        admission = DecodeAdmission(max_memory_bytes=UNKNOWN_IMAGE_BYTES * 2)
+        async with admission.admit(b"not a heif file") as info:
+            assert info is None
+            assert admission.reserved_bytes == UNKNOWN_IMAGE_BYTES
+
+    run(main())
+
+
+def test_too_many_pixels_is_rejected_with_413():
+    async def main():
+        admission = DecodeAdmission(max_pixels=100 * 100)
+        with pytest.raises(HTTPException) as error:
+            async with admission.admit_image(HeifImageInfo(101, 100, 8)):
+                pass
+        assert error.value.status_code == 413
+        assert admission.stats()["rejected_pixels"] == 1
+        assert admission.reserved_bytes == 0
+
+    run(main())
+
+
+def test_zero_budget_disables_admission():
+    async def main():
+        admission = DecodeAdmission(max_memory_bytes=0)
+        async with admission.admit_image(HeifImageInfo(4000, 3000, 8)):
+            async with admission.admit_image(HeifImageInfo(4000, 3000, 8)):
+                assert admission.reserved_bytes == 0
+
+    run(main())
@@ -0,0 +1,98 @@
+import asyncio
+import shutil
+import time
+
+from conversion_cache import ConversionCache
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_memory_tier_is_lru_bounded():
+    async def main():
+        cache = ConversionCache(max_memory_bytes=250, ttl_seconds=60)
+        await cache.put("a", b"a" * 100)
+        await cache.put("b", b"b" * 100)
+        assert await cache.get("a") == b"a" * 100
+        # "b" is now least recently used and is evicted
+        await cache.put("c", b"c" * 100)
+        assert await cache.get("b") is None
+        assert await cache.get("a") == b"a" * 100
+        assert cache.memory_bytes == 200
+        assert cache.stats()["evictions"] == 1
+
+    run(main())
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    async def main():
+        cache = ConversionCache(max_memory_bytes=1000, ttl_seconds=10)
+        await cache.put("a", b"data")
+        later = time.monotonic() + 11
+        monkeypatch.setattr(time, "monotonic", lambda: later)
+        assert await cache.get("a") is None
+        assert cache.stats()["expirations"] == 1
+        assert cache.memory_bytes == 0
+
+    run(main())
+
+
+def test_evicted_entries_are_demoted_to_disk(tmp_path):
+    async def main():
+        cache = ConversionCache(max_memory_bytes=150, ttl_seconds=60, disk_dir=str(tmp_path))
+        try:
+            await cache.put("a", b"a" * 100)
+            await cache.put("b", b"b" * 100)
+            assert cache.stats()["disk_entries"] == 1
+            assert (cache.disk_dir / "a").read_bytes() == b"a" * 100
+
+            # A disk hit is promoted back to memory and its file removed
+            assert await cache.get("a") == b"a" * 100
+            assert not (cache.disk_dir / "a").exists()
+            assert (cache.disk_dir / "b").exists()
+        finally:
+            cache.close()
+
+    run(main())
+
+
+def test_disk_tier_recovers_when_directory_is_removed(tmp_path):
+    async def main():
+        cache = ConversionCache(max_memory_bytes=0, ttl_seconds=60, disk_dir=str(tmp_path))
+        try:
+            shutil.rmtree(cache.disk_dir)
+            await cache.put("a", b"data")
+            assert await cache.get("a") == b"data"
+            assert cache.stats()["evictions"] == 0
+        finally:
+            cache.close()
+
+    run(main())
+
+
+def test_purge_expired_removes_disk_files(tmp_path, monkeypatch):
+    async def main():
+        cache = ConversionCache(max_memory_bytes=0, ttl_seconds=10, disk_dir=str(tmp_path))
+        try:
+            await cache.put("a", b"data")
+            assert (cache.disk_dir / "a").exists()
+            later = time.monotonic() + 11
+            monkeypatch.setattr(time, "monotonic", lambda: later)
+            await cache.purge_expired()
+            assert not (cache.disk_dir / "a").exists()
+            assert cache.disk_bytes == 0
+        finally:
+            cache.close()
+
+    run(main())
+
+
+def test_disabled_cache_stores_nothing():
+    async def main():
+        cache = ConversionCache(max_memory_bytes=0, ttl_seconds=60)
+        assert not cache.enabled
+        await cache.put("a", b"data")
+        assert await cache.get("a") is None
+
+    run(main())
@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+from conversion_executor import PrioritySlots
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def acquire_in_order(slots: PrioritySlots, priorities, order: list, delay: float = 0.0):
+    """
+    Queue one waiter per priority (in the given order) and record the order they get a slot.
+    """
+    async def waiter(name, priority):
+        await slots.acquire(priority)
+        order.append(name)
+
+    tasks = []
+    for name, priority in priorities:
+        tasks.append(asyncio.create_task(waiter(name, priority)))
+        await asyncio.sleep(delay)
+    await asyncio.sleep(0)
+    return tasks
+
+
+def test_free_slots_are_granted_immediately():
+    async def main():
+        slots = PrioritySlots(2, aging_seconds=5)
+        await asyncio.wait_for(slots.acquire("background"), 1)
+        await asyncio.wait_for(slots.acquire("background"), 1)
+        waiter = asyncio.create_task(slots.acquire("interactive"))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        slots.release()
+        await asyncio.wait_for(waiter, 1)
+
+    run(main())
+
+
+def test_waiters_are_served_by_priority_class():
+    async def main():
+        slots = PrioritySlots(1, aging_seconds=60)
+        await slots.acquire("interactive")
+
+        order = []
+        tasks = await acquire_in_order(
+            slots,
+            [("background", "background"), ("batch", "batch"), ("interactive", "interactive")],
+            order
+        )
+        for _ in tasks:
+            slots.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        assert order == ["interactive", "batch", "background"]
+
+    run(main())
+
+
+def test_same_class_is_first_in_first_out():
+    async def main():
+        slots = PrioritySlots(1, aging_seconds=60)
+        await slots.acquire("batch")
+
+        order = []
+        tasks = await acquire_in_order(slots, [(str(i), "batch") for i in range(5)], order)
+        for _ in tasks:
+            slots.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        assert order == ["0", "1", "2", "3", "4"]
+
+    run(main())
+
+
+def test_aging_lets_old_background_work_overtake_new_interactive_work():
+    async def main():
+        slots = PrioritySlots(1, aging_seconds=0.01)
+        await slots.acquire("interactive")
+
+        order = []
+        # Background is two classes down: it outranks interactive work queued 20 ms later
+        tasks = await acquire_in_order(
+            slots, [("background", "background"), ("interactive", "interactive")], order, delay=0.05
+        )
+        for _ in tasks:
+            slots.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        assert order == ["background", "interactive"]
+
+    run(main())
+
+
+def test_cancelled_waiters_are_skipped():
+    async def main():
+        slots = PrioritySlots(1, aging_seconds=60)
+        await slots.acquire("interactive")
+
+        order = []
+        tasks = await acquire_in_order(slots, [("first", "interactive"), ("second", "batch")], order)
+        tasks[0].cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await tasks[0]
+
+        slots.release()
+        await asyncio.wait_for(tasks[1], 1)
+        assert order == ["second"]
+
+        # No slot leaked: after releasing the last holder the next acquire is immediate
+        slots.release()
+        await asyncio.wait_for(slots.acquire("background"), 1)
+
+    run(main())
+
+
+def test_slot_granted_during_cancellation_is_passed_on():
+    async def main():
+        slots = PrioritySlots(1, aging_seconds=60)
+        await slots.acquire("interactive")
+
+        order = []
+        tasks = await acquire_in_order(slots, [("first", "interactive"), ("second", "interactive")], order)
+        # Grant the first waiter's future, then cancel it before it resumes
+        slots.release()
+        tasks[0].cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await tasks[0]
+
+        await asyncio.wait_for(tasks[1], 1)
+        assert order == ["second"]
+
+    run(main())
@@ -0,0 +1,44 @@
+import io
+
+import pillow_heif
+import pytest
+from PIL import Image, ImageCms
+
+from converter import ConversionOptions, convert_heic_to_format, convert_heic_to_pdf_page
+
+pillow_heif.register_heif_opener()
+
+ICC_PROFILE = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+
+
+@pytest.fixture(scope="module")
+def heic_with_metadata() -> bytes:
+    image = Image.new("RGB", (64, 48), (200, 30, 30))
+    exif = Image.Exif()
+    exif[0x010F] = "TestCamera"  # Make
+    buffer = io.BytesIO()
+    image.save(buffer, format="HEIF", exif=exif.tobytes(), icc_profile=ICC_PROFILE)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("output_format", ["jpeg", "png", "webp"])
+def test_metadata_is_stripped_by_default(heic_with_metadata, output_format):
+    output = Image.open(io.BytesIO(convert_heic_to_format(heic_with_metadata, output_format)))
+    assert not output.info.get("icc_profile")
+    assert not output.getexif()
+
+
+def test_metadata_is_kept_on_request(heic_with_metadata):
+    data = convert_heic_to_format(heic_with_metadata, "jpeg", ConversionOptions(strip_metadata=False))
+    output = Image.open(io.BytesIO(data))
+    assert output.info.get("icc_profile") == ICC_PROFILE
+    assert output.getexif()[0x010F] == "TestCamera"
+
+
+@pytest.mark.parametrize("pdf_mode", ["jpeg", "lossless"])
+def test_pdf_pages_follow_strip_metadata(heic_with_metadata, pdf_mode):
+    stripped = convert_heic_to_pdf_page(heic_with_metadata, ConversionOptions(pdf_mode=pdf_mode))
+    assert not Image.open(io.BytesIO(stripped)).info.get("icc_profile")
+
+    kept = convert_heic_to_pdf_page(heic_with_metadata, ConversionOptions(pdf_mode=pdf_mode, strip_metadata=False))
+    assert Image.open(io.BytesIO(kept)).info.get("icc_profile") == ICC_PROFILE
@@ -0,0 +1,125 @@
+import io
+import struct
+
+import pillow_heif
+import pytest
+from PIL import Image
+
+from heif_header import HeifImageInfo, is_heif_header, read_ftyp_brands, read_heif_info
+
+
+def box(box_type: bytes, payload: bytes = b"") -> bytes:
+    return struct.pack(">I", 8 + len(payload)) + box_type + payload
+
+
+def full_box(box_type: bytes, payload: bytes = b"") -> bytes:
+    # version 0, flags 0
+    return box(box_type, b"\0\0\0\0" + payload)
+
+
+def ftyp(major: bytes, *compatible: bytes) -> bytes:
+    return box(b"ftyp", major + b"\0\0\0\0" + b"".join(compatible))
+
+
+def ispe(width: int, height: int) -> bytes:
+    return full_box(b"ispe", struct.pack(">II", width, height))
+
+
+def pixi(*depths: int) -> bytes:
+    return full_box(b"pixi", bytes([len(depths), *depths]))
+
+
+def heif_file(*properties: bytes) -> bytes:
+    ipco = box(b"ipco", b"".join(properties))
+    meta = full_box(b"meta", box(b"hdlr", b"\0" * 24) + box(b"iprp", ipco))
+    return ftyp(b"heic", b"mif1", b"heic") + meta + box(b"mdat", b"\0" * 16)
+
+
+@pytest.fixture(scope="module")
+def encoded_heic() -> bytes:
+    buffer = io.BytesIO()
+    pillow_heif.from_pillow(Image.new("RGB", (640, 480), (200, 30, 30))).save(buffer, quality=50)
+    return buffer.getvalue()
+
+
+def test_real_heic_header(encoded_heic):
+    assert read_ftyp_brands(encoded_heic)[0] in ("heic", "mif1")
+    assert is_heif_header(encoded_heic[:256])
+    info = read_heif_info(encoded_heic)
+    assert (info.width, info.height) == (640, 480)
+    assert info.bit_depth == 8
+
+
+def test_ftyp_brands():
+    assert read_ftyp_brands(ftyp(b"mif1", b"heic", b"miaf")) == ["mif1", "heic", "miaf"]
+    assert is_heif_header(ftyp(b"mif1", b"heic"))
+    # Compatible brand alone is enough (e.g. a generic major brand)
+    assert is_heif_header(ftyp(b"isom", b"heic"))
+    assert not is_heif_header(ftyp(b"isom", b"mp41"))
+
+
+@pytest.mark.parametrize("header", [
+    b"",
+    b"\xff\xd8\xff\xe0" + b"\0" * 20,            # JPEG
+    b"\x89PNG\r\n\x1a\n" + b"\0" * 20,           # PNG
+    ftyp(b"heic")[:12],                          # truncated before the minor version
+    struct.pack(">I", 8) + b"ftypheic\0\0\0\0",  # box size smaller than an ftyp box
+    box(b"free", b"heic" * 4),                   # not an ftyp box
+])
+def test_not_heif_headers(header):
+    assert not is_heif_header(header)
+
+
+def test_compatible_brands_past_the_sniffed_bytes_are_ignored():
+    header = ftyp(b"isom", b"mp41", b"heic")
+    assert read_ftyp_brands(header[:20]) == ["isom", "mp41"]
+    assert not is_heif_header(header[:20])
+
+
+def test_largest_ispe_and_deepest_pixi_win():
+    data = heif_file(ispe(512, 512), pixi(8, 8, 8), ispe(4032, 3024), pixi(10, 10, 10), ispe(256, 256))
+    assert read_heif_info(data) == HeifImageInfo(4032, 3024, 10)
+
+
+def test_decoded_bytes_estimate():
+    assert HeifImageInfo(100, 100, 8).decoded_bytes == 100 * 100 * 7
+    assert HeifImageInfo(100, 100, 10).decoded_bytes == 100 * 100 * 7 * 2
+
+
+def test_missing_pixi_defaults_to_8_bits():
+    assert read_heif_info(heif_file(ispe(64, 32))) == HeifImageInfo(64, 32, 8)
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    ftyp(b"heic", b"mif1"),                                       # no meta box
+    ftyp(b"heic") + full_box(b"meta", box(b"hdlr", b"\0" * 24)),  # no iprp
+    heif_file(),                                                  # no ispe
+    heif_file(ispe(0, 480)),                                      # zero-sized image
+    heif_file(full_box(b"ispe", b"\0\0\0\x10")),                  # ispe payload too short
+])
+def test_no_usable_ispe(data):
+    assert read_heif_info(data) is None
+
+
+def test_truncated_file(encoded_heic):
+    # Cut inside the meta box: the parser stops at the truncated box instead of failing
+    meta_offset = encoded_heic.index(b"meta") - 4
+    for end in (meta_offset + 4, meta_offset + 20, meta_offset + 60):
+        assert read_heif_info(encoded_heic[:end]) is None
+
+
+def test_malformed_box_sizes():
+    properties = ispe(64, 64)
+    # A box claiming to be larger than its parent ends the scan
+    oversized = struct.pack(">I", 10_000) + b"ispe" + properties[8:]
+    assert read_heif_info(heif_file(oversized)) is None
+    # A box size below the header size ends the scan
+    undersized = struct.pack(">I", 4) + b"ispe" + properties[8:]
+    assert read_heif_info(heif_file(undersized)) is None
+
+
+def test_64_bit_box_size():
+    ispe_payload = b"\0\0\0\0" + struct.pack(">II", 800, 600)
+    large_ispe = struct.pack(">I", 1) + b"ispe" + struct.pack(">Q", 16 + len(ispe_payload)) + ispe_payload
+    assert read_heif_info(heif_file(large_ispe)) == HeifImageInfo(800, 600, 8)
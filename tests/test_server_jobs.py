@@ -0,0 +1,66 @@
+import io
+import json
+import time
+import zipfile
+
+
+def submit(client, files, **data) -> str:
+    response = client.post("/api/jobs", files=[("files", item) for item in files], data=data)
+    assert response.status_code == 202, response.text
+    return response.json()["job_id"]
+
+
+def wait_for(client, job_id) -> dict:
+    for _ in range(200):
+        job = client.get(f"/api/jobs/{job_id}").json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish: {job}")
+
+
+def events(client, job_id) -> list:
+    response = client.get(f"/api/jobs/{job_id}/events")
+    parsed = []
+    for block in response.text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines() if ": " in line)
+        if "event" in lines:
+            parsed.append((lines["event"], json.loads(lines["data"])))
+    return parsed
+
+
+def test_job_converts_files_and_reports_progress(client, heic_bytes):
+    job_id = submit(client, [("a.heic", heic_bytes), ("broken.heic", heic_bytes[:400])], output_format="png")
+    job = wait_for(client, job_id)
+    assert job["status"] == "completed"
+    assert [file["status"] for file in job["files"]] == ["done", "failed"]
+
+    names = [event for event, _ in events(client, job_id)]
+    assert names.count("queued") == 2
+    assert "done" in names and "failed" in names and names[-1] == "job"
+
+    result = zipfile.ZipFile(io.BytesIO(client.get(f"/api/jobs/{job_id}/result").content))
+    assert "a.png" in result.namelist()
+
+
+def test_duplicate_and_cached_inputs_are_done(client, heic_bytes):
+    # The second file is coalesced with (or cached from) the first; a second job hits the cache
+    for _ in range(2):
+        job_id = submit(client, [("one.heic", heic_bytes), ("two.heic", heic_bytes)], output_format="jpeg")
+        job = wait_for(client, job_id)
+        assert job["status"] == "completed"
+        assert [file["status"] for file in job["files"]] == ["done", "done"]
+        for file in job["files"]:
+            assert file["error"] is None
+            assert file["queued_seconds"] is not None
+
+        done = [data for event, data in events(client, job_id) if event == "done"]
+        assert sorted(data["filename"] for data in done) == ["one.heic", "two.heic"]
+        assert not [event for event, _ in events(client, job_id) if event == "failed"]
+
+        result = zipfile.ZipFile(io.BytesIO(client.get(f"/api/jobs/{job_id}/result").content))
+        assert sorted(result.namelist()) == ["one.jpg", "two.jpg"]
+
+
+def test_unknown_job_is_not_found(client):
+    assert client.get("/api/jobs/does-not-exist").status_code == 404
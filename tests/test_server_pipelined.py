@@ -0,0 +1,83 @@
+import asyncio
+import io
+import zipfile
+
+BOUNDARY = "pipelinedboundary"
+
+
+def multipart_parts(files) -> list:
+    parts = [
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="files"; filename="{filename}"\r\n'
+        f"Content-Type: image/heic\r\n\r\n".encode() + data + b"\r\n"
+        for filename, data in files
+    ]
+    return parts + [f"--{BOUNDARY}--\r\n".encode()]
+
+
+def test_streams_converted_files_and_errors(client, heic_bytes):
+    body = b"".join(multipart_parts([
+        ("a.heic", heic_bytes), ("b.heic", heic_bytes), ("broken.heic", heic_bytes[:400]), ("notes.txt", b"hi"),
+    ]))
+    response = client.post(
+        "/api/convert-batch/stream?output_format=png",
+        content=body,
+        headers={"content-type": f"multipart/form-data; boundary={BOUNDARY}"},
+    )
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    assert sorted(archive.namelist()) == ["a.png", "b.png", "conversion_errors.txt"]
+    errors = archive.read("conversion_errors.txt").decode()
+    assert "broken.heic" in errors and "notes.txt" in errors
+
+
+def test_rejects_body_that_is_not_multipart(client):
+    response = client.post("/api/convert-batch/stream", content=b"{}", headers={"content-type": "application/json"})
+    assert response.status_code == 422
+
+
+def test_unsent_outputs_hold_back_the_upload(server, heic_bytes, monkeypatch):
+    """
+    While the client isn't reading the response, at most BATCH_CONCURRENCY converted
+    files are held; the rest of the upload isn't read.
+    """
+    monkeypatch.setattr(server, "BATCH_CONCURRENCY", 1)
+    converted = []
+    convert_to_entries = server.convert_to_entries
+
+    async def counting_convert(filename, *args):
+        converted.append(filename)
+        return await convert_to_entries(filename, *args)
+
+    monkeypatch.setattr(server, "convert_to_entries", counting_convert)
+
+    async def main():
+        messages = multipart_parts([(f"{index}.heic", heic_bytes) for index in range(5)])
+        transport_blocked = asyncio.Event()
+
+        async def receive():
+            if not messages:
+                await asyncio.sleep(3600)
+            body = messages.pop(0)
+            return {"type": "http.request", "body": body, "more_body": bool(messages)}
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                # The client isn't reading: the transport never drains
+                transport_blocked.set()
+                await asyncio.sleep(3600)
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+            "scheme": "http", "path": "/api/convert-batch/stream", "raw_path": b"/api/convert-batch/stream",
+            "query_string": b"", "root_path": "", "server": ("test", 80), "client": ("test", 1),
+            "headers": [(b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode())],
+        }
+        app = asyncio.ensure_future(server.app(scope, receive, send))
+        await asyncio.wait_for(transport_blocked.wait(), 10)
+        await asyncio.sleep(0.5)
+        app.cancel()
+        return len(messages)
+
+    unread = asyncio.run(main())
+    assert converted == ["0.heic"]
+    assert unread >= 3
@@ -0,0 +1,85 @@
+import asyncio
+import io
+import json
+
+import pytest
+from PIL import Image
+from starlette.websockets import WebSocketDisconnect
+
+
+def receive_until_finished(websocket, server) -> tuple:
+    """
+    Collect binary result frames until the file's done or error message.
+    """
+    results = []
+    while True:
+        message = websocket.receive()
+        if message.get("bytes") is not None:
+            results.append(server.unpack_frame(message["bytes"]))
+            continue
+        return results, json.loads(message["text"])
+
+
+def test_ready_message_advertises_limits(client, server):
+    with client.websocket_connect("/api/ws/convert") as websocket:
+        ready = websocket.receive_json()
+        assert ready["type"] == "ready"
+        assert ready["credits"] == server.WS_CREDITS
+        assert ready["max_file_bytes"] <= ready["max_message_bytes"] - server.WS_FRAME_HEADER_BYTES
+        assert ready["max_file_bytes"] <= server.upload_limits.max_file_bytes
+
+
+def test_converts_files_over_one_connection(client, server, heic_bytes):
+    with client.websocket_connect("/api/ws/convert") as websocket:
+        websocket.receive_json()
+        websocket.send_bytes(server.pack_frame({"id": 1, "filename": "a.heic", "output_format": "png,webp"}, heic_bytes))
+        results, done = receive_until_finished(websocket, server)
+        assert done == {"type": "done", "id": 1, "outputs": 2, "credits": 1}
+        assert sorted(header["name"] for header, _ in results) == ["a.png", "a.webp"]
+        for header, payload in results:
+            assert header["size"] == len(payload)
+            assert Image.open(io.BytesIO(payload)).size == (64, 48)
+
+
+@pytest.mark.parametrize("frame, status", [
+    (b"\0\0", 400),
+    (b"\0\0\0\x02{}GIF89a", 415),
+])
+def test_bad_files_get_a_per_file_error(client, server, heic_bytes, frame, status):
+    with client.websocket_connect("/api/ws/convert") as websocket:
+        websocket.receive_json()
+        websocket.send_bytes(frame)
+        _, error = receive_until_finished(websocket, server)
+        assert error["type"] == "error" and error["status"] == status and error["credits"] == 1
+
+        # The connection stays usable
+        websocket.send_bytes(server.pack_frame({"id": 2, "filename": "a.heic"}, heic_bytes))
+        _, done = receive_until_finished(websocket, server)
+        assert done["type"] == "done" and done["id"] == 2
+
+
+def test_oversized_file_gets_413(client, server, heic_bytes, monkeypatch):
+    monkeypatch.setattr(server, "WS_MAX_FILE_BYTES", len(heic_bytes) - 1)
+    with client.websocket_connect("/api/ws/convert") as websocket:
+        websocket.receive_json()
+        websocket.send_bytes(server.pack_frame({"id": 1, "filename": "a.heic"}, heic_bytes))
+        _, error = receive_until_finished(websocket, server)
+        assert error["status"] == 413
+
+
+def test_sending_without_credits_closes_the_connection(client, server, heic_bytes, monkeypatch):
+    monkeypatch.setattr(server, "WS_CREDITS", 1)
+
+    async def slow_convert(header, content):
+        await asyncio.sleep(5)
+        return []
+
+    monkeypatch.setattr(server, "convert_websocket_file", slow_convert)
+    with client.websocket_connect("/api/ws/convert") as websocket:
+        assert websocket.receive_json()["credits"] == 1
+        frame = server.pack_frame({"id": 1, "filename": "a.heic"}, heic_bytes)
+        websocket.send_bytes(frame)
+        websocket.send_bytes(frame)
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_json()
+        assert closed.value.code == 1008
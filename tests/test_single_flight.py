@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_concurrent_calls_share_one_computation():
+    async def main():
+        flight = SingleFlight()
+        release = asyncio.Event()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await release.wait()
+            return b"result"
+
+        waiters = [asyncio.ensure_future(flight.do("key", work)) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert flight.stats() == {"in_flight": 1, "started": 1, "coalesced": 2}
+
+        release.set()
+        assert await asyncio.gather(*waiters) == [b"result"] * 3
+        assert calls == [1]
+        assert flight.stats()["in_flight"] == 0
+
+    run(main())
+
+
+def test_finished_calls_are_not_reused():
+    async def main():
+        flight = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            return len(calls)
+
+        assert await flight.do("key", work) == 1
+        assert await flight.do("key", work) == 2
+        assert await flight.do("other", work) == 3
+
+    run(main())
+
+
+def test_exception_is_shared_by_every_waiter():
+    async def main():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            raise ValueError("decode failed")
+
+        waiters = [asyncio.ensure_future(flight.do("key", work)) for _ in range(2)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        assert [type(result) for result in results] == [ValueError, ValueError]
+
+    run(main())
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    async def main():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return b"result"
+
+        first = asyncio.ensure_future(flight.do("key", work))
+        second = asyncio.ensure_future(flight.do("key", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+        release.set()
+        assert await second == b"result"
+
+    run(main())
@@ -0,0 +1,155 @@
+import asyncio
+import struct
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from upload_spool import FormField, SpooledUpload, UploadLimits, iter_multipart, spool_form
+
+BOUNDARY = "testboundary"
+HEIC = struct.pack(">I", 24) + b"ftypheic\0\0\0\0mif1heic" + b"\0" * 1000
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def multipart_body(fields=(), files=()) -> bytes:
+    parts = []
+    for name, value in fields:
+        parts.append(
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'.encode() + value.encode() + b"\r\n"
+        )
+    for name, filename, data in files:
+        parts.append(
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n".encode() + data + b"\r\n"
+        )
+    return b"".join(parts) + f"--{BOUNDARY}--\r\n".encode()
+
+
+def make_request(body: bytes, chunk_size: int = 100, content_type: str = None, content_length: bool = True) -> Request:
+    headers = [(b"content-type", (content_type or f"multipart/form-data; boundary={BOUNDARY}").encode())]
+    if content_length:
+        headers.append((b"content-length", str(len(body)).encode()))
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)] or [b""]
+
+    async def receive():
+        chunk = chunks.pop(0) if chunks else b""
+        return {"type": "http.request", "body": chunk, "more_body": bool(chunks)}
+
+    scope = {"type": "http", "method": "POST", "path": "/", "headers": headers, "query_string": b""}
+    return Request(scope, receive)
+
+
+def status_of(coroutine) -> int:
+    with pytest.raises(HTTPException) as error:
+        run(coroutine)
+    return error.value.status_code
+
+
+def test_fields_and_files_are_parsed_across_chunks():
+    body = multipart_body(
+        fields=[("output_format", "png"), ("quality", "80")],
+        files=[("files", "a.heic", HEIC), ("files", "b.heic", HEIC[:500])],
+    )
+    form = run(spool_form(make_request(body, chunk_size=7), UploadLimits()))
+    try:
+        assert form.get("output_format") == "png"
+        assert form.get_int("quality") == 80
+        assert [upload.filename for upload in form.files_for("files")] == ["a.heic", "b.heic"]
+        assert form.files[0].read() == HEIC
+        assert form.files[1].size == 500
+    finally:
+        form.close()
+
+
+def test_large_files_spill_to_disk():
+    data = HEIC + b"x" * 5000
+    form = run(spool_form(make_request(multipart_body(files=[("files", "a.heic", data)])), UploadLimits(spool_memory_bytes=1024)))
+    try:
+        assert form.files[0].file._rolled
+        assert form.files[0].read() == data
+    finally:
+        form.close()
+
+
+def test_parts_are_yielded_as_they_complete():
+    body = multipart_body(fields=[("output_format", "png")], files=[("files", "a.heic", HEIC)])
+
+    async def main():
+        items = []
+        async for item in iter_multipart(make_request(body), UploadLimits()):
+            items.append(item)
+        return items
+
+    items = run(main())
+    assert items[0] == FormField("output_format", "png")
+    assert isinstance(items[1], SpooledUpload)
+    items[1].close()
+
+
+def test_rejects_body_that_is_not_multipart():
+    request = make_request(b"{}", content_type="application/json")
+    assert status_of(spool_form(request, UploadLimits())) == 422
+
+
+def test_malformed_body_is_a_bad_request():
+    request = make_request(b"this is not a multipart body at all")
+    assert status_of(spool_form(request, UploadLimits())) == 400
+
+
+def test_declared_length_over_the_limit_is_rejected_up_front():
+    body = multipart_body(files=[("files", "a.heic", HEIC)])
+    assert status_of(spool_form(make_request(body), UploadLimits(max_request_bytes=len(body) - 1))) == 413
+
+
+def test_streamed_length_over_the_limit_is_rejected():
+    body = multipart_body(files=[("files", "a.heic", HEIC)])
+    request = make_request(body, content_length=False)
+    assert status_of(spool_form(request, UploadLimits(max_request_bytes=len(body) - 1))) == 413
+
+
+def test_file_over_the_limit_is_rejected():
+    body = multipart_body(files=[("files", "a.heic", HEIC)])
+    assert status_of(spool_form(make_request(body), UploadLimits(max_file_bytes=len(HEIC) - 1))) == 413
+
+
+def test_too_many_files_are_rejected():
+    body = multipart_body(files=[("files", f"{i}.heic", HEIC) for i in range(3)])
+    assert status_of(spool_form(make_request(body), UploadLimits(max_files=2))) == 413
+
+
+def test_oversized_field_is_rejected():
+    body = multipart_body(fields=[("output_format", "x" * 70_000)])
+    assert status_of(spool_form(make_request(body), UploadLimits())) == 413
+
+
+def test_non_heif_file_is_unsupported():
+    body = multipart_body(files=[("files", "photo.heic", b"\xff\xd8\xff\xe0" + b"\0" * 1000)])
+    assert status_of(spool_form(make_request(body), UploadLimits())) == 415
+
+
+def test_short_non_heif_file_is_sniffed_at_its_end():
+    body = multipart_body(files=[("files", "tiny.heic", b"GIF89a")])
+    assert status_of(spool_form(make_request(body), UploadLimits())) == 415
+
+
+def test_skip_unsupported_keeps_going():
+    body = multipart_body(files=[("files", "photo.jpg", b"\xff\xd8\xff" * 500), ("files", "a.heic", HEIC)])
+    form = run(spool_form(make_request(body), UploadLimits(), skip_unsupported=True))
+    try:
+        assert [upload.filename for upload in form.rejected_files()] == ["photo.jpg"]
+        assert form.files[1].read() == HEIC
+        assert not form.files[1].rejected
+    finally:
+        form.close()
+
+
+def test_invalid_option_value_is_unprocessable():
+    form = run(spool_form(make_request(multipart_body(fields=[("quality", "high")])), UploadLimits()))
+    with pytest.raises(HTTPException) as error:
+        form.get_int("quality")
+    assert error.value.status_code == 422
+    assert form.get_bool("missing", True) is True
@@ -0,0 +1,205 @@
+"""
+WorkQueue tests against a real MongoDB server: WORK_QUEUE_TEST_MONGO_URL (default
+mongodb://localhost:27017). Skipped when no server is reachable. Each test uses a
+throwaway database that is dropped afterwards.
+"""
+import asyncio
+import os
+import uuid
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from work_queue import QueueWorker, WorkQueue
+
+MONGO_URL = os.environ.get("WORK_QUEUE_TEST_MONGO_URL", "mongodb://localhost:27017")
+
+
+def mongo_available() -> bool:
+    async def ping():
+        client = AsyncIOMotorClient(MONGO_URL, serverSelectionTimeoutMS=500)
+        try:
+            await client.admin.command("ping")
+            return True
+        except Exception:
+            return False
+        finally:
+            client.close()
+
+    return asyncio.run(ping())
+
+
+pytestmark = pytest.mark.skipif(not mongo_available(), reason=f"No MongoDB server at {MONGO_URL}")
+
+
+def run_with_queue(test, **queue_options):
+    """
+    Run test(queue) on a WorkQueue backed by a fresh database.
+    """
+    async def main():
+        client = AsyncIOMotorClient(MONGO_URL)
+        db_name = f"work_queue_test_{uuid.uuid4().hex[:12]}"
+        try:
+            queue = WorkQueue(client[db_name], **queue_options)
+            await queue.ensure_indexes()
+            await test(queue)
+        finally:
+            await client.drop_database(db_name)
+            client.close()
+
+    asyncio.run(main())
+
+
+def test_claim_leases_a_task_to_one_worker():
+    async def test(queue):
+        task_id = await queue.enqueue("convert", {"n": 1})
+        task = await queue.claim("worker-a")
+        assert task["_id"] == task_id
+        assert task["status"] == "running"
+        assert task["lease_owner"] == "worker-a"
+        assert task["attempts"] == 1
+        assert await queue.claim("worker-b") is None
+
+        assert await queue.heartbeat(task_id, "worker-a")
+        assert not await queue.heartbeat(task_id, "worker-b")
+
+        assert await queue.complete(task_id, "worker-a", {"ok": True})
+        done = await queue.get(task_id)
+        assert done["status"] == "done"
+        assert done["result"] == {"ok": True}
+        assert done["expires_at"] is not None
+        assert (await queue.stats())["done"] == 1
+
+    run_with_queue(test)
+
+
+def test_lower_priority_value_is_claimed_first():
+    async def test(queue):
+        background = await queue.enqueue("convert", {}, priority=2)
+        interactive = await queue.enqueue("convert", {}, priority=0)
+        batch = await queue.enqueue("convert", {}, priority=1)
+        claimed = [(await queue.claim("worker-a"))["_id"] for _ in range(3)]
+        assert claimed == [interactive, batch, background]
+
+    run_with_queue(test)
+
+
+def test_expired_lease_is_requeued_for_another_worker():
+    async def test(queue):
+        task_id = await queue.enqueue("convert", {})
+        await queue.claim("worker-a")
+        await asyncio.sleep(0.3)
+
+        task = await queue.claim("worker-b")
+        assert task["_id"] == task_id
+        assert task["lease_owner"] == "worker-b"
+        assert task["attempts"] == 2
+
+        # The original worker lost the task and can no longer renew or finish it
+        assert not await queue.heartbeat(task_id, "worker-a")
+        assert not await queue.complete(task_id, "worker-a", {})
+        assert await queue.complete(task_id, "worker-b", {})
+
+    run_with_queue(test, lease_seconds=0.2)
+
+
+def test_failed_attempt_is_retried_with_backoff():
+    async def test(queue):
+        task_id = await queue.enqueue("convert", {})
+        task = await queue.claim("worker-a")
+        assert await queue.fail(task, "worker-a", "boom")
+
+        retry = await queue.get(task_id)
+        assert retry["status"] == "queued"
+        assert retry["error"] == "boom"
+        # Not claimable until the retry delay has passed
+        assert await queue.claim("worker-a") is None
+        await asyncio.sleep(0.4)
+        task = await queue.claim("worker-a")
+        assert task["_id"] == task_id
+        assert task["attempts"] == 2
+
+        # The second failure backs off twice as long
+        await queue.fail(task, "worker-a", "boom again")
+        retry = await queue.get(task_id)
+        delay = (retry["available_at"] - task["started_at"]).total_seconds()
+        assert delay == pytest.approx(0.6, abs=0.1)
+
+    run_with_queue(test, retry_delay_seconds=0.3, max_attempts=3)
+
+
+def test_task_is_dead_lettered_after_max_attempts():
+    async def test(queue):
+        task_id = await queue.enqueue("convert", {})
+        task = await queue.claim("worker-a")
+        assert await queue.fail(task, "worker-a", "corrupt input")
+
+        dead = await queue.get(task_id)
+        assert dead["status"] == "dead"
+        assert dead["error"] == "corrupt input"
+        assert dead["expires_at"] is not None
+        assert await queue.claim("worker-a") is None
+        assert (await queue.wait(task_id, poll_seconds=0.05))["status"] == "dead"
+
+    run_with_queue(test, max_attempts=1)
+
+
+def test_abandoned_task_is_dead_lettered_when_out_of_attempts():
+    async def test(queue):
+        task_id = await queue.enqueue("convert", {})
+        await queue.claim("worker-a")
+        await asyncio.sleep(0.3)
+        await queue.recover_expired_leases()
+
+        dead = await queue.get(task_id)
+        assert dead["status"] == "dead"
+        assert dead["error"] == "Lease expired"
+
+    run_with_queue(test, lease_seconds=0.2, max_attempts=1)
+
+
+def test_expired_files_are_purged():
+    async def test(queue):
+        task_id = queue.new_task_id()
+        kept = await queue.put_file("input.heic", b"input", task_id)
+        expired = await queue.put_file("output.jpg", b"output", task_id, expires_in=0)
+
+        record = await queue.file_records.find_one({"_id": kept})
+        assert record["metadata"]["task_id"] == task_id
+
+        assert await queue.purge_expired_files() == 1
+        assert await queue.get_file(kept) == b"input"
+        assert await queue.file_records.find_one({"_id": expired}) is None
+        # Chunks go with the file record
+        assert await queue.files._chunks.count_documents({"files_id": expired}) == 0
+
+    run_with_queue(test)
+
+
+def test_queue_worker_completes_and_fails_tasks():
+    async def test(queue):
+        async def handler(task):
+            if task["payload"]["fail"]:
+                raise ValueError("bad input")
+            return {"doubled": task["payload"]["n"] * 2}
+
+        good = await queue.enqueue("convert", {"n": 21, "fail": False})
+        bad = await queue.enqueue("convert", {"n": 0, "fail": True})
+
+        worker = QueueWorker(queue, handler, concurrency=2, poll_seconds=0.05)
+        running = asyncio.create_task(worker.run_forever())
+        try:
+            good_task = await asyncio.wait_for(queue.wait(good, poll_seconds=0.05), 5)
+            bad_task = await asyncio.wait_for(queue.wait(bad, poll_seconds=0.05), 5)
+        finally:
+            running.cancel()
+            worker.stop()
+
+        assert good_task["status"] == "done"
+        assert good_task["result"] == {"doubled": 42}
+        assert bad_task["status"] == "dead"
+        assert bad_task["error"] == "bad input"
+        assert worker.stats()["completed"] == 1
+        assert worker.stats()["failed"] == 1
+
+    run_with_queue(test, max_attempts=1)
@@ -0,0 +1,68 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from conversion_jobs import JobStore
+from worker_dirs import WORKER_DIR_PREFIX, purge_stale_worker_dirs, worker_dir
+
+TWO_HOURS = 2 * 3600
+
+
+def make_dir(base, name, age_seconds=0):
+    path = base / name
+    (path / "job").mkdir(parents=True)
+    (path / "job" / "input.heic").write_bytes(b"data")
+    stamp = time.time() - age_seconds
+    for item in (path / "job" / "input.heic", path / "job", path):
+        os.utime(item, (stamp, stamp))
+    return path
+
+
+def dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_removes_directory_of_dead_local_pid(tmp_path):
+    path = make_dir(tmp_path, f"{WORKER_DIR_PREFIX}{socket.gethostname()}-{dead_pid()}")
+    purge_stale_worker_dirs(tmp_path, max_age_seconds=3600)
+    assert not path.exists()
+
+
+def test_keeps_idle_directory_of_live_local_pid(tmp_path):
+    sibling = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        path = make_dir(tmp_path, f"{WORKER_DIR_PREFIX}{socket.gethostname()}-{sibling.pid}", TWO_HOURS)
+        purge_stale_worker_dirs(tmp_path, max_age_seconds=60)
+        assert path.exists()
+    finally:
+        sibling.kill()
+        sibling.wait()
+
+
+def test_other_hosts_expire_by_age(tmp_path):
+    old = make_dir(tmp_path, f"{WORKER_DIR_PREFIX}other-host-{os.getpid()}", TWO_HOURS)
+    recent = make_dir(tmp_path, f"{WORKER_DIR_PREFIX}other-host-{os.getpid() + 1}")
+    purge_stale_worker_dirs(tmp_path, max_age_seconds=3600)
+    assert not old.exists()
+    assert recent.exists()
+
+
+def test_never_removes_own_directory(tmp_path):
+    path = make_dir(tmp_path, worker_dir(tmp_path).name, TWO_HOURS)
+    purge_stale_worker_dirs(tmp_path, max_age_seconds=0)
+    assert path.exists()
+
+
+def test_job_store_recreates_missing_root(tmp_path):
+    store = JobStore(root_dir=str(tmp_path), ttl_seconds=60)
+    try:
+        # e.g. removed by a tmp cleaner while the worker is idle
+        os.rmdir(store.root_dir)
+        job = store.create({})
+        assert job.directory.is_dir()
+    finally:
+        store.close()
@@ -0,0 +1,60 @@
+import io
+import os
+import zipfile
+
+from zipstream import ZipStreamWriter
+
+
+def build_archive(entries) -> bytes:
+    writer = ZipStreamWriter()
+    chunks = [writer.add(name, data) for name, data in entries]
+    chunks.append(writer.close())
+    return b"".join(chunks)
+
+
+def test_streamed_archive_opens_with_zipfile():
+    entries = [
+        ("photo.jpg", os.urandom(50_000)),
+        ("photo.png", os.urandom(10_000)),
+        ("conversion_errors.txt", b"broken.heic: decoding failed\n" * 20),
+        ("empty.webp", b""),
+    ]
+    archive = zipfile.ZipFile(io.BytesIO(build_archive(entries)))
+    assert archive.testzip() is None
+    assert archive.namelist() == [name for name, _ in entries]
+    for name, data in entries:
+        assert archive.read(name) == data
+
+
+def test_each_add_returns_only_its_entry():
+    writer = ZipStreamWriter()
+    first = writer.add("a.jpg", b"a" * 1000)
+    second = writer.add("b.jpg", b"b" * 1000)
+    central_directory = writer.close()
+
+    # Entries are written with data descriptors, so each chunk is self-contained
+    assert first.startswith(b"PK\x03\x04") and second.startswith(b"PK\x03\x04")
+    assert b"b" * 1000 not in first
+    assert central_directory.startswith(b"PK\x01\x02")
+
+
+def test_compressed_formats_are_stored_and_others_deflated():
+    archive = zipfile.ZipFile(io.BytesIO(build_archive([
+        ("a.JPG", b"x" * 10_000),
+        ("a.webp", b"x" * 10_000),
+        ("a.pdf", b"x" * 10_000),
+        ("errors.txt", b"x" * 10_000),
+    ])))
+    compression = {info.filename: info.compress_type for info in archive.infolist()}
+    assert compression == {
+        "a.JPG": zipfile.ZIP_STORED,
+        "a.webp": zipfile.ZIP_STORED,
+        "a.pdf": zipfile.ZIP_STORED,
+        "errors.txt": zipfile.ZIP_DEFLATED,
+    }
+    assert archive.getinfo("errors.txt").compress_size < 10_000
+
+
+def test_empty_archive():
+    archive = zipfile.ZipFile(io.BytesIO(ZipStreamWriter().close()))
+    assert archive.namelist() == []